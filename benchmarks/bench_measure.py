@@ -0,0 +1,42 @@
+""" Compare measuring strings one at a time with measure_many().
+
+    python -m benchmarks.bench_measure <font> [strings]
+"""
+import random
+import sys
+import timeit
+
+from zttf.ttf import TTFont, numpy
+
+
+def make_strings(font, count):
+    rnd = random.Random(1)
+    chars = [chr(c) for c in sorted(font.char_index) if 0x20 < c < 0x250]
+    return [''.join(rnd.choice(chars) for n in range(rnd.randint(1, 40))) for s in range(count)]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(0)
+    font = TTFont(sys.argv[1], 0)
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    strings = make_strings(font, count)
+
+    tests = [
+        ('get_string_width loop', lambda: [font.get_string_width(s) for s in strings]),
+        ('measure_many (python)', lambda: font.measure_many(strings, use_numpy=False)),
+    ]
+    if numpy is not None:
+        tests.append(('measure_many (numpy)', lambda: font.measure_many(strings, use_numpy=True)))
+
+    print("{} strings".format(count))
+    base = None
+    for name, fn in tests:
+        elapsed = min(timeit.repeat(fn, number=1, repeat=5))
+        base = base or elapsed
+        print("  {:24s} {:8.2f} ms  ({:.1f}x)".format(name, elapsed * 1000, base / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+""" Report the memory held by parsed fonts.
+
+    python -m benchmarks.bench_memory <font> [<font> ...]
+"""
+import gc
+import sys
+import tracemalloc
+
+from zttf.ttf import TTFont
+
+
+def font_memory(filename, copies=20):
+    """ Return the average number of bytes allocated per parsed copy of the font. """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fonts = [TTFont(filename, 0) for n in range(copies)]
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del fonts
+    return (after - before) / copies
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(0)
+    for filename in sys.argv[1:]:
+        print("{:>10.0f} bytes per font  {}".format(font_memory(filename), filename))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+""" Compare decoding a large name table with the compiled PackedFormat codecs against the
+    previous field by field decoding.
+
+    python -m benchmarks.bench_name_table [records]
+"""
+import sys
+import timeit
+from io import BytesIO
+from struct import calcsize, pack, unpack
+
+from zttf.objects import TTF_name, TTFNameRecord
+
+
+def build_name_table(n_records):
+    # Storage offsets are 16 bit, so records share a pool of strings.
+    strings = [u'Name record {}'.format(n).encode('utf-16-be') for n in range(500)]
+    offsets = []
+    offset = 0
+    for raw in strings:
+        offsets.append(offset)
+        offset += len(raw)
+    records = b''
+    for n in range(n_records):
+        raw = strings[n % len(strings)]
+        records += pack(">6H", 3, 1, 0x409, n % 256, len(raw), offsets[n % len(strings)])
+    return pack(">3H", 0, n_records, 6 + 12 * n_records) + records + b''.join(strings)
+
+
+def legacy_from_file(obj, fh):
+    """ The per field decoding used before FORMAT was compiled. """
+    for _f in obj.FORMAT:
+        _fmt = '{}{}'.format(obj.endian, _f['format'])
+        _data = unpack(_fmt, fh.read(calcsize(_fmt)))[0]
+        setattr(obj, _f['name'], _data)
+
+
+def decode_records(data, n_records, from_file):
+    fh = BytesIO(data)
+    fh.seek(6)
+    for n in range(n_records):
+        rec = TTFNameRecord.__new__(TTFNameRecord)
+        rec.endian = '>'
+        from_file(rec, fh)
+
+
+def main():
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    data = build_name_table(n_records)
+    repeat = 20
+
+    legacy = min(timeit.repeat(lambda: decode_records(data, n_records, legacy_from_file),
+                               number=1, repeat=repeat))
+    compiled = min(timeit.repeat(lambda: decode_records(data, n_records, TTFNameRecord.from_file),
+                                 number=1, repeat=repeat))
+    table = min(timeit.repeat(lambda: TTF_name(BytesIO(data), len(data)), number=1, repeat=repeat))
+
+    print("{} name records".format(n_records))
+    print("  per field decode:   {:8.2f} ms".format(legacy * 1000))
+    print("  compiled decode:    {:8.2f} ms  ({:.1f}x)".format(compiled * 1000, legacy / compiled))
+    print("  TTF_name (complete):{:8.2f} ms".format(table * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+""" Throughput of subset_many() for different numbers of worker processes.
+
+    python -m benchmarks.bench_subset_many <font> [subsets] [max workers]
+"""
+import os
+import random
+import sys
+import time
+
+from zttf.ttfile import TTFile, subset_many
+
+
+def make_subsets(font, count):
+    rnd = random.Random(1)
+    chars = [c for c in sorted(font.char_index) if 0x20 < c < 0x250]
+    return [rnd.sample(chars, rnd.randint(20, min(120, len(chars)))) for s in range(count)]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(0)
+    filename = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    max_workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count() or 1
+    subsets = make_subsets(TTFile(filename).faces[0], count)
+
+    print("{} subsets, {} CPUs".format(count, os.cpu_count()))
+    workers = 1
+    while workers <= max_workers:
+        start = time.time()
+        subset_many(filename, subsets, workers=workers, chunksize=max(1, count // (workers * 8)))
+        elapsed = time.time() - start
+        print("  {:3d} workers {:8.2f} s  {:8.1f} subsets/s".format(workers, elapsed, count / elapsed))
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -26,13 +26,14 @@ setup(
         'Topic :: Software Development :: Libraries :: Python Modules',
         'Topic :: Text Processing :: Fonts',
         'License :: OSI Approved :: Apache Software License',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.2',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3 :: Only',
     ],
     keywords='fonts truetype ttf',
-    packages=find_packages(exclude=['tests']),
+    python_requires='>=3.7',
+    packages=find_packages(exclude=['tests', 'benchmarks']),
+    extras_require={
+        'numpy': ['numpy'],
+    },
     test_suite='tests'
 )
@@ -0,0 +1,139 @@
+import io
+import os
+import shutil
+import unittest
+from contextlib import redirect_stdout
+from threading import Thread
+
+from zttf.cache import LRUCache, SubsetCache
+from zttf.ttf import TTFont
+from tests.fonts import FontTestCase
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_max_entries(self):
+        cache = LRUCache(max_entries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        # 'b' was the least recently used.
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get_or_create('c', lambda: 99), 3)
+        stats = cache.stats()
+        del stats['bytes']
+        self.assertEqual(stats, {'entries': 2, 'hits': 2, 'misses': 1, 'evictions': 1})
+
+    def test_max_bytes(self):
+        cache = LRUCache(max_bytes=10, sizeof=lambda entry: len(entry[1]))
+        cache.put('a', 'x' * 4)
+        cache.put('b', 'x' * 4)
+        cache.put('a', 'x' * 2)
+        self.assertEqual(cache.stats()['bytes'], 6)
+        cache.put('c', 'x' * 6)
+        self.assertEqual(sorted(cache.entries), ['a', 'c'])
+        cache.put('d', 'x' * 20)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    def test_threads(self):
+        cache = LRUCache(max_entries=50)
+
+        def worker():
+            for n in range(2000):
+                self.assertEqual(cache.get_or_create(n % 100, lambda: (n % 100) * 2), (n % 100) * 2)
+
+        threads = [Thread(target=worker) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 50)
+        self.assertEqual(stats['hits'] + stats['misses'], 8000)
+
+
+class TestSubsetCache(FontTestCase):
+    def test_trim_directory(self):
+        directory = self.directory
+        cache = SubsetCache(directory=directory, max_disk_bytes=250)
+        for n, key in enumerate(['a', 'b', 'c']):
+            cache._write_file(key, b'x' * 100)
+            os.utime(os.path.join(directory, key + cache.SUFFIX), (n, n))
+            # The disk copy of 'a' is used again, so 'b' is the oldest.
+            if key == 'b':
+                self.assertEqual(cache._read_file('a'), b'x' * 100)
+        cache._trim_directory()
+        self.assertEqual(sorted(os.listdir(directory)), ['a.ttf', 'c.ttf'])
+        self.assertEqual(cache.stats()['disk_hits'], 1)
+
+    def test_key(self):
+        path = self.font_path()
+        font = TTFont(path, 0)
+        cache = SubsetCache()
+        key = cache.key(font, [0x41, 0x56])
+        # Repeated characters and characters missing from the font don't change the key.
+        self.assertEqual(cache.key(font, [0x56, 0x41, 0x41, 0x7A]), key)
+        self.assertNotEqual(cache.key(font, [0x41]), key)
+        os.utime(path, (1, 1))
+        self.assertNotEqual(cache.key(font, [0x41, 0x56]), key)
+
+        cache = SubsetCache(content_hash=True)
+        key = cache.key(font, [0x41, 0x56])
+        os.utime(path, (2, 2))
+        self.assertEqual(cache.key(font, [0x41, 0x56]), key)
+
+    def test_get_subset(self):
+        font = TTFont(self.font_path(), 0)
+        directory = os.path.join(self.directory, 'subsets')
+        cache = SubsetCache(directory=directory)
+        data = cache.get_subset(font, [0x41, 0xC5])
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(data, font.make_subset([0x41, 0xC5]).output())
+        self.assertIs(cache.get_subset(font, [0xC5, 0x41]), data)
+        self.assertEqual(os.listdir(directory), [cache.key(font, [0x41, 0xC5]) + cache.SUFFIX])
+
+        # A new cache finds the subset on disk.
+        cache = SubsetCache(directory=directory)
+        self.assertEqual(cache.get_subset(font, [0x41, 0xC5]), data)
+        self.assertEqual(cache.get_subset(font, [0x41, 0xC5]), data)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['disk_hits']), (1, 1, 1))
+
+    def test_write_threads(self):
+        cache = SubsetCache(directory=self.directory)
+        output = io.StringIO()
+        errors = []
+
+        def worker(n):
+            for m in range(20):
+                try:
+                    cache._write_file('a', bytes([n]) * 100000)
+                except OSError as e:
+                    errors.append(e)
+
+        threads = [Thread(target=worker, args=(n,)) for n in range(8)]
+        with redirect_stdout(output):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(output.getvalue(), '')
+        self.assertEqual(os.listdir(self.directory), ['a.ttf'])
+        data = cache._read_file('a')
+        self.assertEqual(data, data[:1] * 100000)
+
+    def test_write_failed(self):
+        font = TTFont(self.font_path(), 0)
+        directory = os.path.join(self.directory, 'subsets')
+        cache = SubsetCache(directory=directory)
+        shutil.rmtree(directory)
+        # The subset is returned, and kept in memory, although it can't be written to disk.
+        output = io.StringIO()
+        with redirect_stdout(output):
+            data = cache.get_subset(font, [0x41])
+        self.assertEqual(data, font.make_subset([0x41]).output())
+        self.assertIn('Unable to write the subset', output.getvalue())
+        self.assertIs(cache.get_subset(font, [0x41]), data)
@@ -0,0 +1,161 @@
+""" Small synthetic fonts for the tests, built from the tables the library reads. """
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from zttf.utils import binary_search_parameters, ttf_checksum
+
+
+def simple_glyph(x, y):
+    # One contour with a single on curve point, 19 bytes so the glyph needs padding.
+    return struct.pack(">5h", 1, x, y, x, y) + struct.pack(">HHB2h", 0, 0, 1, x, y)
+
+
+def compound_glyph(components):
+    data = struct.pack(">5h", -1, 0, 0, 100, 100)
+    for n, glyph in enumerate(components):
+        # Word xy offsets, with more components to follow for all but the last.
+        flags = 0x0003 | (0x0020 if n < len(components) - 1 else 0)
+        data += struct.pack(">2H2h", flags, glyph, 10 * n, 0)
+    return data
+
+
+# (advance, lsb, glyf data) for each glyph.
+GLYPHS = [
+    (500, 10, simple_glyph(10, 0)),      # 0 .notdef
+    (250, 0, b''),                       # 1 space
+    (600, 20, simple_glyph(20, 0)),      # 2 A
+    (650, 5, simple_glyph(5, 0)),        # 3 V
+    (300, 50, simple_glyph(50, 600)),    # 4 ring
+    (600, 20, compound_glyph([2, 4])),   # 5 Aring
+    (1000, 30, simple_glyph(30, 0)),     # 6 grinning face
+    (700, 20, compound_glyph([5, 3])),   # 7 Aring with a compound component
+]
+CHARS = {0x20: 1, 0x41: 2, 0x56: 3, 0xC5: 5, 0x1FA: 7, 0x2DA: 4, 0x1F600: 6}
+KERN_PAIRS = [(2, 3, -80), (3, 2, -70), (5, 3, -60)]
+
+
+def cmap_table(chars):
+    bmp = sorted(c for c in chars if c < 0xFFFF)
+    seg_count = len(bmp) + 1
+    src_range, selector = binary_search_parameters(seg_count)
+    fmt4 = struct.pack(">4H", seg_count * 2, src_range * 2, selector, (seg_count - src_range) * 2)
+    fmt4 += struct.pack(">{}H".format(seg_count), *(bmp + [0xFFFF])) + b'\0\0'
+    fmt4 += struct.pack(">{}H".format(seg_count), *(bmp + [0xFFFF]))
+    fmt4 += struct.pack(">{}H".format(seg_count), *([(chars[c] - c) & 0xFFFF for c in bmp] + [1]))
+    fmt4 += b'\0\0' * seg_count
+    fmt4 = struct.pack(">3H", 4, len(fmt4) + 6, 0) + fmt4
+
+    groups = b''.join(struct.pack(">3I", c, c, chars[c]) for c in sorted(chars))
+    fmt12 = struct.pack(">2H3I", 12, 0, len(groups) + 16, 0, len(chars)) + groups
+    return struct.pack(">2H", 0, 2) + struct.pack(">2HI", 3, 1, 20) + \
+        struct.pack(">2HI", 3, 10, 20 + len(fmt4)) + fmt4 + fmt12
+
+
+def name_table(names):
+    records = b''
+    strings = b''
+    for name_id, value in sorted(names.items()):
+        value = value.encode('latin-1')
+        records += struct.pack(">6H", 1, 0, 0, name_id, len(value), len(strings))
+        strings += value
+    return struct.pack(">3H", 0, len(names), 6 + len(records)) + records + strings
+
+
+def kern_table(pairs):
+    src_range, selector = binary_search_parameters(len(pairs))
+    body = struct.pack(">4H", len(pairs), 6 * src_range, selector, 6 * (len(pairs) - src_range))
+    body += b''.join(struct.pack(">2Hh", *pair) for pair in sorted(pairs))
+    return struct.pack(">2H", 0, 1) + struct.pack(">3H", 0, 6 + len(body), 1) + body
+
+
+def font_tables(family='Test', name='Test-Regular', glyphs=GLYPHS, chars=CHARS, kern=KERN_PAIRS, gpos=None):
+    """ Return a dict of tag to table data for a font.
+    :param kern: List of (left, right, value) pairs for a kern table, or None
+    :param gpos: GPOS table data, or None
+    """
+    glyf = b''
+    loca = [0]
+    for advance, lsb, data in glyphs:
+        glyf += data + b'\0' * (len(data) % 2)
+        loca.append(len(glyf))
+    tables = {
+        b'head': struct.pack(">2i2I2H2q4h3H2h", 0x00010000, 0x00010000, 0, 0x5F0F3CF5, 0, 1000, 0, 0,
+                             0, -200, 1000, 800, 0, 8, 2, 0, 0),
+        b'hhea': struct.pack(">i3hH6hqhH", 0x00010000, 800, -200, 90, 1000, 0, 0, 1000, 1, 0, 0, 0, 0,
+                             len(glyphs)),
+        b'maxp': struct.pack(">I14H", 0x00010000, len(glyphs), *([0] * 13)),
+        b'OS/2': struct.pack(">3H", 1, 500, 400) + b'\0' * 80 + struct.pack(">2h3H", 450, 700, 0, 0x20, 2),
+        b'post': struct.pack(">2I2h5I", 0x00030000, 0, -100, 50, 0, 0, 0, 0, 0),
+        b'name': name_table({1: family, 6: name}),
+        b'cmap': cmap_table(chars),
+        b'hmtx': b''.join(struct.pack(">Hh", advance, lsb) for advance, lsb, data in glyphs),
+        b'loca': struct.pack(">{}H".format(len(loca)), *[n // 2 for n in loca]),
+        b'glyf': glyf,
+    }
+    if kern is not None:
+        tables[b'kern'] = kern_table(kern)
+    if gpos is not None:
+        tables[b'GPOS'] = gpos
+    return tables
+
+
+def _offset_table(entries):
+    """ Return the offset table for a list of (tag, offset, data). """
+    src_range, selector = binary_search_parameters(len(entries))
+    data = struct.pack(">I4H", 0x00010000, len(entries), 16 * src_range, selector, 16 * (len(entries) - src_range))
+    for tag, offset, table in sorted(entries):
+        data += struct.pack(">4s3I", tag, ttf_checksum(table), offset, len(table))
+    return data
+
+
+def collection_file(faces):
+    """ Return a TrueType collection of the faces, each a dict of tag to table data. Tables
+        with the same data are only stored once and shared by the faces.
+    """
+    start = 12 + 4 * len(faces) + sum(12 + 16 * len(tables) for tables in faces)
+    return _font_file(faces, start, 12 + 4 * len(faces))
+
+
+def font_file(tables):
+    """ Return a TrueType file for a dict of tag to table data. """
+    return _font_file([tables], 12 + 16 * len(tables), 0)[12 + 4:]
+
+
+def _font_file(faces, start, header_end):
+    locations = {}
+    body = b''
+    for tables in faces:
+        for tag in sorted(tables):
+            if tables[tag] not in locations:
+                locations[tables[tag]] = start + len(body)
+                body += tables[tag] + b'\0' * (-len(tables[tag]) % 4)
+    headers = b''
+    offsets = []
+    for tables in faces:
+        offsets.append(header_end + len(headers))
+        headers += _offset_table([(tag, locations[data], data) for tag, data in tables.items()])
+    header = struct.pack(">4sI", b'ttcf', 0x00010000) + struct.pack(">{}I".format(len(faces) + 1), len(faces),
+                                                                     *offsets)
+    return header + headers + body
+
+
+class FontTestCase(unittest.TestCase):
+    """ Test case with a temporary directory to write fonts to. """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_file(self, data, name='test.ttf'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as fh:
+            fh.write(data)
+        return path
+
+    def font_path(self, filename='test.ttf', **kwargs):
+        """ Write a font made by font_tables, returning the path. """
+        return self.write_file(font_file(font_tables(**kwargs)), filename)
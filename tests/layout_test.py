@@ -0,0 +1,40 @@
+import unittest
+from array import array
+
+from zttf.layout import LineBreaker, break_lines, fit_font_size
+from zttf.utils import GlyphMetrics, GlyphRun
+
+
+class FixedWidthFont(object):
+    """ Every character is glyph 1, 100 units wide. """
+    units_per_em = 1000
+    glyph_metrics = GlyphMetrics(array('H', [0, 100]), array('h', [0, 0]))
+
+    def glyph_run(self, text):
+        return GlyphRun.from_glyphs([1] * len(text), self.glyph_metrics, [0] * max(len(text) - 1, 0))
+
+    def get_string_width(self, text):
+        return 100 * len(text)
+
+
+class TestLayout(unittest.TestCase):
+    def test_greedy(self):
+        lines = break_lines(FixedWidthFont(), "aaa bb cc ddddddd e\nf", 700)
+        self.assertEqual([line.text for line in lines], ['aaa bb', 'cc', 'ddddddd', 'e', 'f'])
+        self.assertEqual([line.width for line in lines], [600, 200, 700, 100, 100])
+        self.assertEqual(break_lines(FixedWidthFont(), "  ", 700), [])
+
+    def test_optimal(self):
+        text = "aaa bb cc ddddd"
+        breaker = LineBreaker(FixedWidthFont(), text)
+        self.assertEqual([line.text for line in breaker.break_lines(600)], ['aaa bb', 'cc', 'ddddd'])
+        self.assertEqual([line.text for line in breaker.break_lines(600, optimal=True)], ['aaa', 'bb cc', 'ddddd'])
+        self.assertEqual(breaker.width(4, 9), 500)
+
+    def test_fit_font_size(self):
+        font = FixedWidthFont()
+        self.assertEqual(fit_font_size(font, "abcd", 3, 24), 7.5)
+        self.assertEqual(fit_font_size(font, "abcd", 3, 5), 5)
+        # Two lines of 2 characters at 15, but only one line fits in the height.
+        self.assertEqual(fit_font_size(font, "ab cd", 3, 24, height=20, line_height=1), 10)
+        self.assertEqual(fit_font_size(font, "ab cd", 3, 24, height=40, line_height=1), 15)
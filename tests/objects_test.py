@@ -0,0 +1,151 @@
+import unittest
+import struct
+from io import BytesIO
+
+from zttf.objects import TTF_cmap, TTF_gpos
+from zttf.utils import Kerning
+
+
+def cmap_table(platform_id, encoding_id, subtable):
+    return struct.pack(">HHHHI", 0, 1, platform_id, encoding_id, 12) + subtable
+
+
+def cmap4_subtable():
+    # Segments: 0x20-0x22 by delta, 0x41-0x43 through the glyph id array, 0xFFFF end marker.
+    seg_count = 3
+    body = struct.pack(">5H", 0, seg_count * 2, 4, 1, 2)
+    body += struct.pack(">3H", 0x22, 0x43, 0xFFFF) + struct.pack(">H", 0)
+    body += struct.pack(">3H", 0x20, 0x41, 0xFFFF)
+    body += struct.pack(">3h", -29, 5, 1)
+    body += struct.pack(">3H", 0, 4, 0)
+    body += struct.pack(">3H", 10, 0, 12)
+    return struct.pack(">HH", 4, len(body) + 4) + body
+
+
+def cmap12_subtable(fmt, groups):
+    body = struct.pack(">II", 0, len(groups))
+    for group in groups:
+        body += struct.pack(">3I", *group)
+    return struct.pack(">HHI", fmt, 0, len(body) + 8) + body
+
+
+def pair_glyphs_subtable(pairs):
+    # Pair adjustment format 1 with only XAdvance values for the first glyph.
+    lefts = sorted(set(left for left, right, value in pairs))
+    coverage = struct.pack(">2H", 1, len(lefts)) + struct.pack(">{}H".format(len(lefts)), *lefts)
+    sets = b''
+    offsets = []
+    start = 10 + 2 * len(lefts) + len(coverage)
+    for left in lefts:
+        records = [(right, value) for l, right, value in pairs if l == left]
+        offsets.append(start + len(sets))
+        sets += struct.pack(">H", len(records)) + b''.join(struct.pack(">Hh", *r) for r in records)
+    return struct.pack(">5H", 1, 10 + 2 * len(lefts), 4, 0, len(lefts)) + \
+        struct.pack(">{}H".format(len(lefts)), *offsets) + coverage + sets
+
+
+def pair_classes_subtable():
+    # Glyphs 1 and 4 are covered, with 4 in class 1. Glyphs 2 and 3 are in second class 1.
+    matrix = struct.pack(">4h", 0, -10, -30, -40)
+    coverage = struct.pack(">4H", 1, 2, 1, 4)
+    class1 = struct.pack(">4H", 1, 4, 1, 1)
+    class2 = struct.pack(">5H", 2, 1, 2, 3, 1)
+    start = 16 + len(matrix)
+    return struct.pack(">8H", 2, start, 4, 0, start + len(coverage), start + len(coverage) + len(class1), 2, 2) + \
+        matrix + coverage + class1 + class2
+
+
+def gpos_table(features, lookups):
+    """ features is a list of (tag, [lookup indices]), lookups a list of (type, [subtables]). """
+    feature_list = struct.pack(">H", len(features))
+    tables = b''
+    for tag, indices in features:
+        feature_list += struct.pack(">4sH", tag, 2 + 6 * len(features) + len(tables))
+        tables += struct.pack(">2H", 0, len(indices)) + struct.pack(">{}H".format(len(indices)), *indices)
+    feature_list += tables
+
+    lookup_list = struct.pack(">H", len(lookups))
+    tables = b''
+    for lookup_type, subtables in lookups:
+        lookup_list += struct.pack(">H", 2 + 2 * len(lookups) + len(tables))
+        offsets = []
+        body = b''
+        for subtable in subtables:
+            offsets.append(6 + 2 * len(subtables) + len(body))
+            body += subtable
+        tables += struct.pack(">3H", lookup_type, 0, len(subtables)) + \
+            struct.pack(">{}H".format(len(offsets)), *offsets) + body
+    lookup_list += tables
+    return struct.pack(">I3H", 0x00010000, 0, 10, 10 + len(feature_list)) + feature_list + lookup_list
+
+
+class TestGpos(unittest.TestCase):
+    def test_kern_lookups(self):
+        extension = struct.pack(">HHI", 1, 2, 8) + pair_glyphs_subtable([(4, 2, -5)])
+        data = gpos_table([(b'liga', [1]), (b'kern', [2, 0])],
+                          [(2, [pair_glyphs_subtable([(1, 2, -50), (1, 3, -20), (1, 3, -99)]),
+                                pair_classes_subtable()]),
+                           (2, [pair_glyphs_subtable([(1, 2, 1000)])]),
+                           (9, [extension])])
+        lookups = TTF_gpos.kern_lookups(data, 6)
+        self.assertEqual([len(lookup) for lookup in lookups], [2, 1])
+        kerning = Kerning(lookups)
+        # The first subtable that covers a pair is used and the lookups are added.
+        self.assertEqual(kerning.value(1, 2), -50)
+        self.assertEqual(kerning.value(1, 3), -20)
+        self.assertEqual(kerning.value(1, 5), 0)
+        self.assertEqual(kerning.value(4, 2), -45)
+        self.assertEqual(kerning.value(4, 5), -30)
+        self.assertEqual(kerning.value(5, 2), 0)
+        self.assertEqual(TTF_gpos.kern_lookups(data, 6, feature=b'none'), [])
+
+
+class TestCmap(unittest.TestCase):
+    EXPECTED = {0x20: 3, 0x21: 4, 0x22: 5, 0x41: 15, 0x43: 17}
+
+    def test_format4(self):
+        data = cmap_table(3, 1, cmap4_subtable())
+        cmap = TTF_cmap(BytesIO(data), len(data))
+        for char in range(0x10000):
+            self.assertEqual(cmap.char_to_glyph(char), self.EXPECTED.get(char, 0))
+        self.assertEqual(cmap.char_map(), {c: g for c, g in self.EXPECTED.items() if c <= 256})
+        self.assertEqual(cmap.char_map(0x40), {0x20: 3, 0x21: 4, 0x22: 5})
+
+    def test_format4_followed(self):
+        # The glyph id array ends at the subtable length, not at the next subtable.
+        body = struct.pack(">5H", 0, 4, 4, 1, 0) + struct.pack(">3H", 0x22, 0xFFFF, 0) + \
+            struct.pack(">2H", 0x20, 0xFFFF) + struct.pack(">2h", -29, 1) + struct.pack(">2H", 0, 0)
+        no_ids = struct.pack(">HH", 4, len(body) + 4) + body
+        fmt12 = cmap12_subtable(12, [(0x41, 0x43, 7)])
+        for fmt4, glyph_ids in ((cmap4_subtable(), [10, 0, 12]), (no_ids, [])):
+            data = struct.pack(">2H", 0, 2) + struct.pack(">2HI", 3, 1, 20) + \
+                struct.pack(">2HI", 3, 10, 20 + len(fmt4)) + fmt4 + fmt12
+            cmap = TTF_cmap(BytesIO(data), len(data))
+            map_data = cmap.tables[(3, 1)].map_data
+            self.assertEqual(list(map_data.glyph_ids), glyph_ids)
+            self.assertEqual(map_data.char_to_glyph(0x21), 4)
+
+    def test_format4_dense(self):
+        data = cmap_table(3, 1, cmap4_subtable())
+        cmap = TTF_cmap(BytesIO(data), len(data))
+        cmap.map_table.enable_dense_map()
+        for char in range(0x10000):
+            self.assertEqual(cmap.char_to_glyph(char), self.EXPECTED.get(char, 0))
+        self.assertIsNotNone(cmap.map_table.dense)
+        self.assertEqual(cmap.char_to_glyph(0x1F600), 0)
+
+    def test_format12(self):
+        data = cmap_table(3, 10, cmap12_subtable(12, [(0x41, 0x43, 7), (0x1F600, 0x1F602, 100)]))
+        cmap = TTF_cmap(BytesIO(data), len(data))
+        self.assertEqual(cmap.char_to_glyph(0x40), 0)
+        self.assertEqual(cmap.char_to_glyph(0x42), 8)
+        self.assertEqual(cmap.char_to_glyph(0x1F601), 101)
+        self.assertEqual(cmap.char_to_glyph(0x1F603), 0)
+        self.assertEqual(cmap.map_table.as_map(0x1F600), {0x41: 7, 0x42: 8, 0x43: 9, 0x1F600: 100})
+
+    def test_format13(self):
+        data = cmap_table(0, 6, cmap12_subtable(13, [(0x20, 0x7E, 3), (0x10000, 0x10FFFF, 4)]))
+        cmap = TTF_cmap(BytesIO(data), len(data))
+        self.assertEqual(cmap.char_to_glyph(0x41), 3)
+        self.assertEqual(cmap.char_to_glyph(0x20000), 4)
+        self.assertEqual(cmap.char_to_glyph(0x1F), 0)
@@ -0,0 +1,98 @@
+import os
+import sys
+from threading import Barrier, Thread
+
+from zttf.registry import FontRegistry
+from tests.fonts import FontTestCase, collection_file, font_tables
+
+
+class TestFontRegistry(FontTestCase):
+    def test_reuse(self):
+        registry = FontRegistry()
+        path = self.font_path('a.ttf')
+        first = registry.get_file(path)
+        self.assertIs(registry.get_file(path), first)
+        self.assertEqual(registry.get_font(path).name, 'Test-Regular')
+        # A changed file is opened again and the old entry removed.
+        self.font_path('a.ttf', name='Test-Bold')
+        os.utime(path, (1, 1))
+        second = registry.get_file(path)
+        self.assertIsNot(second, first)
+        self.assertIs(registry.get_file(path), second)
+        self.assertEqual(registry.get_font(path).name, 'Test-Bold')
+        self.assertEqual(registry.stats()['entries'], 1)
+
+    def test_faces(self):
+        registry = FontRegistry()
+        path = self.write_file(collection_file([font_tables(), font_tables(family='Other', name='Other-Bold')]),
+                               'test.ttc')
+        self.assertEqual(registry.get_font(path, 1).name, 'Other-Bold')
+        self.assertIs(registry.find_face(path, 'Other'), registry.get_font(path, 1))
+        self.assertIs(registry.find_face(path, 'Test-Regular'), registry.get_font(path))
+
+    def test_eviction(self):
+        paths = [self.font_path(name) for name in ('a.ttf', 'b.ttf', 'c.ttf')]
+        size = os.path.getsize(paths[0])
+        registry = FontRegistry(max_fonts=2, max_bytes=int(2.5 * size))
+        files = [registry.get_file(path) for path in paths[:2]]
+        registry.get_file(paths[0])
+        registry.get_file(paths[2])
+        # b was the least recently used.
+        self.assertEqual(sorted(registry.keys), sorted([paths[0], paths[2]]))
+        self.assertIs(registry.get_file(paths[0]), files[0])
+        self.assertIsNot(registry.get_file(paths[1]), files[1])
+        self.assertEqual(registry.stats()['evictions'], 2)
+        self.assertEqual(len(registry.keys), 2)
+
+        registry = FontRegistry(max_bytes=int(2.5 * size))
+        for path in paths:
+            registry.get_file(path)
+        self.assertEqual(registry.stats()['entries'], 2)
+        self.assertEqual(registry.stats()['bytes'], 2 * size)
+        registry.clear()
+        self.assertEqual(registry.keys, {})
+
+    def test_threads(self):
+        registry = FontRegistry()
+        path = self.font_path()
+        results = []
+
+        def worker():
+            for n in range(100):
+                results.append(registry.get_file(path))
+
+        threads = [Thread(target=worker) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # Every thread gets the same file.
+        self.assertEqual(len(set(id(ttf) for ttf in results)), 1)
+        self.assertEqual(registry.stats()['misses'], 1)
+
+    def test_shared_font(self):
+        # Threads given the same lazily parsed face all parse it at once.
+        path = self.font_path()
+        expected = FontRegistry(lazy=False).get_font(path)
+        expected = (expected.name, expected.get_string_width('AVA'), expected.make_subset([0x41, 0x1FA]).output())
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for n in range(20):
+                registry = FontRegistry()
+                barrier = Barrier(4)
+                results = []
+
+                def worker():
+                    barrier.wait()
+                    font = registry.get_font(path)
+                    results.append((font.name, font.get_string_width('AVA'), font.make_subset([0x41, 0x1FA]).output()))
+
+                threads = [Thread(target=worker) for t in range(4)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                self.assertEqual(results, [expected] * 4)
+        finally:
+            sys.setswitchinterval(interval)
@@ -0,0 +1,133 @@
+import os
+import struct
+from array import array
+
+from zttf.sidecar import ENTRY, HEADER, _lookup_arrays, _read_lookups, load_font, read_sidecar, sidecar_path, \
+    write_sidecar
+from zttf.ttf import TTFont
+from zttf.ttfile import TTFile
+from zttf.utils import KernClasses, KernPairs, Kerning
+from tests.fonts import FontTestCase, collection_file, font_tables
+from tests.objects_test import gpos_table, pair_classes_subtable, pair_glyphs_subtable
+
+
+class TestSidecar(FontTestCase):
+    def test_lookups(self):
+        pairs = KernPairs.from_items([((1 << 16) | 2, -10), ((3 << 16) | 1, 5)])
+        classes = KernClasses(1, array('H', [0, 1]), 0, array('H', [1, 0, 1]), 2, array('h', [0, -20, 0, 30]))
+        lookups = [[pairs, classes], [KernPairs()]]
+        arrays = dict(_lookup_arrays('kpos', lookups))
+        self.assertEqual(arrays['kpos/0/1/meta'].tolist(), [1, 0, 2])
+        loaded = _read_lookups('kpos', arrays)
+        self.assertEqual([[type(s) for s in lookup] for lookup in loaded],
+                         [[KernPairs, KernClasses], [KernPairs]])
+        kerning = Kerning(loaded)
+        for left in range(4):
+            for right in range(4):
+                self.assertEqual(kerning.value(left, right), Kerning(lookups).value(left, right))
+        self.assertEqual(_read_lookups('kern', arrays), [])
+
+    def assertSameFont(self, font, expected):
+        self.assertEqual(font.char_index, expected.char_index)
+        self.assertEqual(list(font.glyph_metrics), list(expected.glyph_metrics))
+        self.assertEqual(font.component_graph.components, expected.component_graph.components)
+        for left in range(8):
+            for right in range(8):
+                self.assertEqual(font.get_kern_value(left, right), expected.get_kern_value(left, right))
+        self.assertEqual(font.make_subset([0x41, 0x56, 0x1FA]).output(),
+                         expected.make_subset([0x41, 0x56, 0x1FA]).output())
+
+    def test_load_font(self):
+        gpos = gpos_table([(b'kern', [0])], [(2, [pair_glyphs_subtable([(2, 3, -500), (3, 5, 20)])])])
+        path = self.font_path(gpos=gpos)
+        expected = TTFont(path, 0)
+        sidecar = sidecar_path(path)
+        self.assertEqual(sidecar, os.path.join(self.directory, 'test.ttf.0.zttx'))
+        # The first load parses the font and writes the sidecar, the second uses it.
+        font = load_font(path)
+        self.assertFalse(font.lazy)
+        self.assertTrue(os.path.exists(sidecar))
+        font = load_font(path)
+        self.assertTrue(font.lazy)
+        self.assertEqual(font.glyph_kern.value(2, 3), -80)
+        self.assertEqual(font.get_kern_value(2, 3), -500)
+        self.assertSameFont(font, expected)
+        self.assertIsNone(font.file_handle)
+
+        self.assertEqual(write_sidecar(expected), sidecar)
+        self.assertSameFont(load_font(path, write=False), expected)
+
+    def test_collection(self):
+        path = self.write_file(collection_file([font_tables(), font_tables(name='Test-Bold', kern=[(3, 2, -5)])]),
+                               'test.ttc')
+        ttf = TTFile(path)
+        expected = TTFont(path, ttf.faces.offsets[1])
+        ttf.close()
+        sidecar = write_sidecar(expected)
+        self.assertEqual(sidecar, sidecar_path(path, expected.start_pos))
+        self.assertIsNotNone(read_sidecar(sidecar, path, expected.start_pos))
+        # The face offset must match.
+        self.assertIsNone(read_sidecar(sidecar, path, 0))
+        self.assertSameFont(load_font(path, expected.start_pos), expected)
+
+    def test_stale(self):
+        path = self.font_path()
+        sidecar = write_sidecar(TTFont(path, 0))
+        # A changed font is parsed again and the sidecar replaced.
+        self.font_path(kern=[(2, 3, -10)])
+        os.utime(path, (1, 1))
+        self.assertIsNone(read_sidecar(sidecar, path))
+        font = load_font(path)
+        self.assertFalse(font.lazy)
+        self.assertEqual(font.get_kern_value(2, 3), -10)
+        self.assertEqual(load_font(path).get_kern_value(2, 3), -10)
+
+    def test_touched(self):
+        path = self.font_path()
+        sidecar = write_sidecar(TTFont(path, 0))
+        # The font is unchanged, so the sidecar is used and records the new mtime.
+        os.utime(path, (2, 2))
+        self.assertIsNotNone(read_sidecar(sidecar, path))
+        with open(sidecar, 'rb') as fh:
+            header = HEADER.unpack(fh.read(HEADER.size))
+        self.assertEqual(header[3:5], (2, os.path.getsize(path)))
+        self.assertTrue(load_font(path).lazy)
+
+    def test_invalid(self):
+        path = self.font_path()
+        sidecar = write_sidecar(TTFont(path, 0))
+        with open(sidecar, 'rb') as fh:
+            data = fh.read()
+        for bad in (b'ZTTY' + data[4:], data[:4] + struct.pack(">H", 2) + data[6:], data[:HEADER.size - 1], b''):
+            with open(sidecar, 'wb') as fh:
+                fh.write(bad)
+            self.assertIsNone(read_sidecar(sidecar, path))
+        self.assertIsNone(read_sidecar(sidecar + '.missing', path))
+        self.assertFalse(load_font(path).lazy)
+        self.assertTrue(load_font(path).lazy)
+
+    def test_truncated(self):
+        path = self.font_path()
+        sidecar = write_sidecar(TTFont(path, 0))
+        with open(sidecar, 'rb') as fh:
+            data = fh.read()
+        # Cut within the directory, within the last array (of int16 kerning values) and
+        # between its last two values.
+        for size in (HEADER.size + ENTRY.size * 2 + 3, len(data) - 1, len(data) - 2):
+            with open(sidecar, 'wb') as fh:
+                fh.write(data[:size])
+            self.assertIsNone(read_sidecar(sidecar, path))
+            self.assertFalse(load_font(path).lazy)
+            self.assertTrue(load_font(path).lazy)
+
+    def test_long_name(self):
+        # The array names for the last lookup, with 101 subtables, are too long for the directory.
+        gpos = gpos_table([(b'kern', list(range(11)))], [(2, [pair_glyphs_subtable([(2, 3, -5)])])] * 10 +
+                          [(2, [pair_classes_subtable()] * 101)])
+        path = self.font_path(gpos=gpos)
+        with self.assertRaises(ValueError):
+            write_sidecar(TTFont(path, 0))
+        self.assertFalse(os.path.exists(sidecar_path(path)))
+        # The font is still loaded, without a sidecar.
+        self.assertEqual(len(load_font(path).kerning.lookups), 11)
+        self.assertFalse(os.path.exists(sidecar_path(path)))
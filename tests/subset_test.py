@@ -0,0 +1,158 @@
+import unittest
+import struct
+from io import BytesIO
+from types import SimpleNamespace
+
+from zttf.objects import TTF_kern
+from zttf.subset import TTFSubset
+from zttf.ttf import TTFont
+from zttf.utils import ttf_checksum, KernClasses, KernPairs
+from tests.fonts import FontTestCase, KERN_PAIRS
+
+
+class TestSubsetOutput(unittest.TestCase):
+    def test_glyph_tables(self):
+        subset = TTFSubset(None, [])
+        subset.metrics = [(500, 0), (600, 10)]
+        subset.add_glyph_tables([b'abc', b''])
+        self.assertEqual(subset.loca_format, 0)
+        self.assertEqual(subset.tables[b'glyf'].getvalue(), b'abc\0')
+        self.assertEqual(subset.tables[b'loca'].getvalue(), struct.pack(">3H", 0, 2, 2))
+        self.assertEqual(subset.tables[b'hmtx'].getvalue(), struct.pack(">HhHh", 500, 0, 600, 10))
+
+        subset.add_glyph_tables([b'a' * 0x20000, b'b'])
+        self.assertEqual(subset.loca_format, 1)
+        self.assertEqual(subset.tables[b'loca'].getvalue(), struct.pack(">3I", 0, 0x20000, 0x20002))
+
+    def test_write_font(self):
+        subset = TTFSubset(None, [])
+        subset.start_table(b'head', struct.pack(">2I", 0x00010000, 1) + b'\xff' * 4 + b'\1' * 42)
+        subset.start_table(b'abcd', b'12345')
+        subset.start_table(b'wxyz', b'\xfe' * 13)
+        data = subset.write_font()
+        self.assertIsInstance(data, bytearray)
+        self.assertEqual(len(data), 12 + 3 * 16 + 56 + 8 + 16)
+        self.assertEqual(ttf_checksum(data), 0xB1B0AFBA)
+        # Table data is padded to 4 bytes.
+        self.assertEqual(data[60:68], b'12345\0\0\0')
+        fh = BytesIO()
+        self.assertEqual(subset.write_font(fh), len(data))
+        self.assertEqual(fh.getvalue(), data)
+
+        # The tables can still be written to after a failed write, even while the error
+        # (and so the frames of write_font) is kept.
+        fh = BytesIO()
+        fh.close()
+        try:
+            subset.write_font(fh)
+        except ValueError as e:
+            error = e
+        self.assertIsNotNone(error.__traceback__)
+        for table in subset.tables.values():
+            table.write(b'\0')
+
+    def test_kern_subtables(self):
+        entries = {(5, 1): -20, (1, 2): 10, (3, 1): -20, (3, 2): 15, (5, 2): 10, (1, 1): -20}
+        data = TTFSubset.kern_format0(entries)
+        self.assertEqual(struct.unpack_from(">3H4H", data), (0, 6 * 6 + 14, 1, 6, 24, 2, 12))
+        pairs = KernPairs.from_format0(data[14:], 6)
+        self.assertEqual(list(pairs.keys), sorted((l << 16) | r for l, r in entries))
+        self.assertEqual(dict(pairs.items()), entries)
+
+        data = TTFSubset.kern_format2(entries)
+        self.assertEqual(struct.unpack_from(">3H", data), (0, len(data), 0x0201))
+        classes = KernClasses.from_format2(data)
+        # Glyphs 1 and 5 have the same kerning, as do the glyphs on the right.
+        self.assertEqual(classes.n_cols, 3)
+        for left in range(7):
+            for right in range(7):
+                self.assertEqual(classes.value(left, right), entries.get((left, right), 0))
+
+    def kern_table(self, entries):
+        """ Return the kern subtable formats and pairs written by add_kern_data for entries. """
+        glyphs = sorted(set(g for pair in entries for g in pair))
+        subset = TTFSubset(SimpleNamespace(glyph_kern=KernPairs.from_items(
+            ((l << 16) | r, v) for (l, r), v in entries.items())), [])
+        subset.required_glyphs = glyphs
+        subset.glyph_map = {g: g for g in glyphs}
+        subset.add_kern_data()
+        data = subset.tables[b'kern'].getvalue()
+        kern = TTF_kern(BytesIO(data))
+        formats = []
+        pairs = {}
+        for st in kern.subtables:
+            formats.append(st.format)
+            n_pairs, src_rng, sel, shift = struct.unpack_from(">4H", data, st.offset + 6)
+            self.assertEqual((src_rng, sel, shift), (6 * 2 ** sel, sel, 6 * n_pairs - src_rng))
+            pairs.update(KernPairs.from_format0(data[st.offset + 14:], n_pairs).items())
+        return formats, pairs
+
+    def test_kern_overflow(self):
+        # Every row and column differs, so the class matrix offsets don't fit in 16 bits.
+        entries = {(g, g): -(g % 100) - 1 for g in range(11700)}
+        self.assertIsNone(TTFSubset.kern_format2(entries))
+        self.assertEqual(self.kern_table(entries), ([0], entries))
+
+        # Too many pairs for the format 0 search range as well, so they are split.
+        entries = {(g, g): -(g % 100) - 1 for g in range(19700)}
+        self.assertIsNone(TTFSubset.kern_format0(entries))
+        self.assertIsNone(TTFSubset.kern_format2(entries))
+        self.assertEqual(self.kern_table(entries), ([0, 0], entries))
+
+
+class TestSubsetSession(FontTestCase):
+    def parse(self, data, name):
+        return TTFont(self.write_file(data, name), 0)
+
+    def test_add(self):
+        font = TTFont(self.font_path(), 0)
+        session = font.make_subset_session([0x41])
+        self.assertEqual(session.add([0x41, 0x56]), [1, 2])
+        first = self.parse(session.output(), 'first.ttf')
+        # Glyph 7 is a compound of 5 and 3, and 5 of 2 and 4.
+        self.assertEqual(session.add([0x1FA, 0x41, 0x7A]), [3, 1, None])
+        self.assertEqual(session.add([0xC5, 0x56]), [5, 2])
+        self.assertEqual(session.required_glyphs, [0, 2, 3, 7, 4, 5])
+
+        second = self.parse(session.output(), 'second.ttf')
+        self.assertEqual(first.char_index, {0x41: 1, 0x56: 2})
+        self.assertEqual(second.char_index, {0x41: 1, 0x56: 2, 0xC5: 5, 0x1FA: 3})
+        self.assertEqual(list(second.glyph_metrics.advances), [500, 600, 650, 700, 300, 600])
+        # The components of the compound glyphs use the subset glyph ids.
+        self.assertEqual(second.component_graph.components, {3: (5, 2), 5: (1, 4)})
+        # Glyphs already output are unchanged.
+        for glyph in range(3):
+            self.assertEqual(bytes(second.get_glyph_data(glyph)), bytes(first.get_glyph_data(glyph)))
+            self.assertEqual(second.glyph_metrics[glyph], first.glyph_metrics[glyph])
+        self.assertEqual([second.get_kern_value(*pair) for pair in [(1, 2), (2, 1), (5, 2), (3, 2)]],
+                         [-80, -70, -60, 0])
+        self.assertEqual(session.output(), session.output())
+
+
+class TestSubsetKern(FontTestCase):
+    def test_add_kern_data(self):
+        dense = [(l, r, 10 * l - r) for l in range(8) for r in range(8) if l != r]
+        # The sparse pairs are written as format 0 subtables and the dense ones (apart from
+        # the smaller subsets) as format 2.
+        for kern, formats in ((KERN_PAIRS, [0, 0, 0]), (dense, [0, 0, 2, 2])):
+            font = TTFont(self.font_path('kern.ttf', kern=kern), 0)
+            used = []
+            for chars in ([0x41], [0x41, 0x56], [0xC5, 0x56], [0x1FA, 0x20, 0x1F600]):
+                subset = font.make_subset(chars)
+                data = subset.output()
+                glyph_map = subset.glyph_map
+                expected = {(glyph_map[l], glyph_map[r]): v for (l, r), v in font.glyph_kern.items()
+                            if l in glyph_map and r in glyph_map}
+                if len(expected) == 0:
+                    self.assertNotIn(b'kern', subset.tables)
+                    continue
+                parsed = TTFont(self.write_file(data, 'subset.ttf'), 0)
+                used.append(parsed.get_table(b'kern').subtables[0].format)
+                for left in range(len(glyph_map)):
+                    for right in range(len(glyph_map)):
+                        self.assertEqual(parsed.get_kern_value(left, right), expected.get((left, right), 0))
+            self.assertEqual(used, formats)
+
+        subset = TTFont(self.font_path('none.ttf', kern=None), 0).make_subset([0x41, 0x56])
+        subset.output()
+        self.assertNotIn(b'kern', subset.tables)
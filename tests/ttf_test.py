@@ -0,0 +1,89 @@
+import unittest
+
+from zttf.ttf import TTFont, numpy
+from tests.fonts import FontTestCase
+from tests.objects_test import gpos_table, pair_classes_subtable, pair_glyphs_subtable
+
+
+class TestTTFont(FontTestCase):
+    def test_char_width(self):
+        font = TTFont(self.font_path(), 0)
+        self.assertEqual(font.get_char_width('A'), 600)
+        self.assertEqual(font.get_char_width(0x56), 650)
+        self.assertEqual(font.get_char_width('\U0001F600'), 1000)
+        # Characters not in the font have the width of the .notdef glyph.
+        self.assertEqual(font.get_char_width('z'), 500)
+
+    def test_lazy(self):
+        path = self.font_path()
+        eager = TTFont(path, 0)
+        font = TTFont(path, 0, lazy=True)
+        self.assertEqual(font.tables, {})
+        self.assertIsNone(font.file_handle)
+        self.assertEqual(font.name, 'Test-Regular')
+        self.assertEqual(list(font.tables), [b'name'])
+        self.assertEqual(font.char_index, eager.char_index)
+        self.assertEqual(list(font.glyph_metrics), list(eager.glyph_metrics))
+        self.assertEqual(font.get_kern_value(2, 3), -80)
+        self.assertEqual(font.get_glyph_components(7), [2, 3, 4, 5])
+        self.assertEqual(font.make_subset([0x41, 0x1FA]).output(), eager.make_subset([0x41, 0x1FA]).output())
+        # The file is closed after every read.
+        self.assertIsNone(font.file_handle)
+
+    STRINGS = ['', 'A', 'AV', 'VAV', 'A VA', '\u00c5V\u01fa', '\U0001F600A', '\ud800V', 'zA\uffff', 'VV']
+
+    def measure_fonts(self):
+        gpos = gpos_table([(b'kern', [0, 1])],
+                          [(2, [pair_glyphs_subtable([(2, 3, -500), (3, 3, 7)]), pair_classes_subtable()]),
+                           (2, [pair_glyphs_subtable([(2, 3, 20)])])])
+        return [TTFont(self.font_path(), 0), TTFont(self.font_path('gpos.ttf', gpos=gpos), 0),
+                TTFont(self.font_path('none.ttf', kern=None), 0)]
+
+    def test_measure_many(self):
+        for font in self.measure_fonts():
+            widths = font.measure_many(self.STRINGS, use_numpy=False)
+            self.assertEqual(list(widths), [font.get_string_width(s) for s in self.STRINGS])
+        self.assertEqual(list(font.measure_many([], use_numpy=False)), [])
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_measure_many_numpy(self):
+        for font in self.measure_fonts():
+            widths = font.measure_many(self.STRINGS, use_numpy=True)
+            self.assertEqual(widths.tolist(), [font.get_string_width(s) for s in self.STRINGS])
+            self.assertEqual(font.measure_many(['A'], use_numpy=True).tolist(), [580])
+        self.assertEqual(font.measure_many([], use_numpy=True).tolist(), [])
+
+    def test_mmap(self):
+        path = self.font_path()
+        expected = TTFont(path, 0)
+        font = TTFont(path, 0, use_mmap=True)
+        self.assertEqual(font.name, 'Test-Regular')
+        self.assertEqual(list(font.glyph_metrics), list(expected.glyph_metrics))
+        self.assertEqual(list(font.get_table(b'loca')), list(expected.get_table(b'loca')))
+        self.assertEqual(font.get_kern_value(2, 3), -80)
+        # Glyph data is a view of the mapping rather than a copy.
+        data = font.get_glyph_data(2)
+        self.assertIsInstance(data, memoryview)
+        self.assertEqual(bytes(data), expected.get_glyph_data(2))
+        data.release()
+        self.assertEqual(font.make_subset([0x41, 0x1FA]).output(), expected.make_subset([0x41, 0x1FA]).output())
+        font.close()
+        self.assertIsNone(font.data)
+
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        font = TTFont(path, 0, data=data)
+        self.assertEqual(font.make_subset([0x56]).output(), expected.make_subset([0x56]).output())
+        font.close()
+
+    def test_char_index(self):
+        font = TTFont(self.font_path(), 0)
+        # Characters beyond the BMP come from the format 12 subtable.
+        self.assertEqual(font.char_index, {0x20: 1, 0x41: 2, 0x56: 3, 0xC5: 5, 0x1FA: 7, 0x2DA: 4, 0x1F600: 6})
+        self.assertIs(font.char_index, font.char_index)
+        self.assertEqual(font.char_to_glyph(0x1F600), 6)
+        self.assertEqual(font.string_to_glyphs('A\U0001F600\U0001F601'), [2, 6, 0])
+        subset = font.make_subset([0x1F600, 0x41])
+        subset.output()
+        self.assertEqual(subset.required_glyphs, [0, 2, 6])
+        self.assertEqual(subset.char_to_glyph, {0x41: 1, 0x1F600: 2})
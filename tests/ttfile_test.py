@@ -0,0 +1,85 @@
+from zttf import ttfile
+from zttf.ttf import TTFont
+from zttf.ttfile import TTFile, subset_many
+from tests.fonts import FontTestCase, collection_file, font_tables
+from tests.objects_test import gpos_table, pair_glyphs_subtable
+
+
+class TestTTFile(FontTestCase):
+    def collection_path(self):
+        return self.write_file(collection_file([font_tables(family='Test', name='Test-Regular'),
+                                                font_tables(family='Test', name='Test-Bold', kern=None),
+                                                font_tables(family='Other', name='Other-Regular')]),
+                               'test.ttc')
+
+    def test_single_font(self):
+        ttf = TTFile(self.font_path())
+        self.assertTrue(ttf.is_valid)
+        self.assertEqual(len(ttf.faces), 1)
+        self.assertEqual(ttf.faces[0].name, 'Test-Regular')
+        self.assertEqual(ttf.face_names(0), ('Test-Regular', 'Test'))
+        ttf.close()
+
+    def test_faces(self):
+        ttf = TTFile(self.collection_path())
+        self.assertEqual(len(ttf.faces), 3)
+        # Faces are only parsed when used.
+        self.assertEqual(ttf.faces.fonts, [None] * 3)
+        self.assertEqual(ttf.face_names(1), ('Test-Bold', 'Test'))
+        self.assertEqual(ttf.faces.fonts, [None] * 3)
+        bold = ttf.faces[1]
+        self.assertIs(ttf.faces[1], bold)
+        self.assertEqual(ttf.faces.fonts.count(None), 2)
+        self.assertEqual([face.name for face in ttf.faces[1:]], ['Test-Bold', 'Other-Regular'])
+        self.assertEqual([face.name for face in ttf.faces], ['Test-Regular', 'Test-Bold', 'Other-Regular'])
+        self.assertEqual(ttf.face_names(1), ('Test-Bold', 'Test'))
+        ttf.close()
+
+    def test_find_face(self):
+        ttf = TTFile(self.collection_path())
+        self.assertIs(ttf.find_face('Test-Bold'), ttf.faces[1])
+        self.assertEqual(ttf.faces.fonts[0], None)
+        # Family names match the first face in the family.
+        self.assertIs(ttf.find_face('Other'), ttf.faces[2])
+        self.assertIs(ttf.find_face('Test'), ttf.faces[0])
+        self.assertIsNone(ttf.find_face('Missing'))
+        ttf.close()
+
+    def test_table_cache(self):
+        ttf = TTFile(self.collection_path())
+        regular, bold, other = ttf.faces
+        # Tables with the same data are stored once in the collection and parsed once.
+        self.assertIs(regular.get_table(b'head'), bold.get_table(b'head'))
+        self.assertIs(regular.glyph_metrics, other.glyph_metrics)
+        self.assertIs(regular.char_index, bold.char_index)
+        self.assertIsNot(regular.get_table(b'name'), bold.get_table(b'name'))
+        self.assertEqual(regular.get_kern_value(2, 3), -80)
+        self.assertEqual(bold.get_kern_value(2, 3), 0)
+        ttf.close()
+
+    def test_shared_gpos(self):
+        # The faces share a GPOS table without a kern feature, so each uses its kern table.
+        gpos = gpos_table([(b'liga', [0])], [(2, [pair_glyphs_subtable([(2, 3, -500)])])])
+        path = self.write_file(collection_file([font_tables(gpos=gpos),
+                                                font_tables(name='Test-Bold', kern=[(3, 2, -10)], gpos=gpos)]),
+                               'test.ttc')
+        ttf = TTFile(path)
+        self.assertEqual([face.get_kern_value(2, 3) for face in ttf.faces], [-80, 0])
+        self.assertEqual([face.get_kern_value(3, 2) for face in ttf.faces], [-70, -10])
+        self.assertEqual([len(face.kerning.lookups) for face in ttf.faces], [1, 1])
+        ttf.close()
+
+    def test_subset_many(self):
+        path = self.font_path()
+        subsets = [[0x41], [0x41, 0x56, 0xC5], [0x1FA, 0x20]]
+        font = TTFont(path, 0)
+        expected = [font.make_subset(subset).output() for subset in subsets]
+        self.assertEqual(subset_many(path, subsets, workers=1), expected)
+        # The font is only kept open in the worker processes.
+        self.assertIsNone(ttfile._worker_font)
+        self.assertEqual(subset_many(path, subsets, workers=2, chunksize=2), expected)
+
+        ttf = TTFile(self.collection_path())
+        self.assertEqual(ttf.subset_many(subsets, face=0, workers=2, chunksize=2), expected)
+        self.assertEqual(ttf.subset_many(subsets, face=0, workers=1), expected)
+        ttf.close()
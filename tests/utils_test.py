@@ -1,7 +1,19 @@
 import unittest
 import struct
 
-from zttf.utils import fixed_version, binary_search_parameters, ttf_checksum, glyph_more_components, glyf_skip_format
+from io import BytesIO
+
+from zttf.utils import fixed_version, binary_search_parameters, ttf_checksum, glyph_more_components, glyf_skip_format, \
+    PackedFormat, ComponentGraph, GlyphMetrics, GlyphRun, read_array, KernPairs, KernClasses
+
+
+class SamplePacked(PackedFormat):
+    FORMAT = [
+        {'name': 'version', 'format': 'I', 'convert': fixed_version},
+        {'name': 'tag', 'format': '4s'},
+        {'format': 'H'},
+        {'name': 'value', 'format': 'h'},
+    ]
 
 
 class TestUtils(unittest.TestCase):
@@ -42,3 +54,104 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(glyf_skip_format((1 << 3) | (1 << 0)), ">IH")
         self.assertEqual(glyf_skip_format((1 << 7)), ">HII")
 
+    def test_packed_format(self):
+        data = struct.pack(">I4sHh", 0x00010000, b'test', 99, -5)
+        self.assertEqual(len(SamplePacked()), len(data))
+
+        obj = SamplePacked(BytesIO(data))
+        self.assertTrue(obj.parsed)
+        self.assertEqual(obj.version, 1.0)
+        self.assertEqual(obj.version_raw, 0x00010000)
+        self.assertEqual(obj.tag, b'test')
+        self.assertEqual(obj.value, -5)
+        # Unnamed fields are written as 0.
+        self.assertEqual(obj.as_bytes(), struct.pack(">I4sHh", 0x00010000, b'test', 0, -5))
+
+        obj = SamplePacked()
+        obj.from_data(b'\0\0' + data, 2)
+        self.assertEqual(obj.version, 1.0)
+        self.assertEqual(obj.value, -5)
+
+    def test_read_array(self):
+        self.assertEqual(list(read_array('H', struct.pack(">3H", 1, 256, 65535))), [1, 256, 65535])
+        self.assertEqual(list(read_array('h', struct.pack(">2h", -2, 300))), [-2, 300])
+
+    def test_glyph_metrics(self):
+        data = struct.pack(">HhHh3h", 500, -10, 600, 20, 1, -2, 3)
+        metrics = GlyphMetrics.from_hmtx(data, 2, 5)
+        self.assertEqual(len(metrics), 5)
+        self.assertEqual(metrics[0], (500, -10))
+        self.assertEqual(metrics[1], (600, 20))
+        self.assertEqual(list(metrics)[2:], [(600, 1), (600, -2), (600, 3)])
+
+    def test_component_graph(self):
+        simple = struct.pack(">5h", 1, 0, 0, 10, 10)
+
+        def compound(*components):
+            data = struct.pack(">5h", -1, 0, 0, 10, 10)
+            for n, glyph in enumerate(components):
+                more = 0x20 if n < len(components) - 1 else 0
+                # Word arguments and a scale, so there is data to skip.
+                data += struct.pack(">HHhhH", 0x01 | 0x08 | more, glyph, 0, 0, 0x4000)
+            return data
+
+        glyphs = [simple, compound(0, 2), compound(3), simple, compound(1, 3), b'']
+        data = b''.join(glyphs)
+        loca = [0]
+        for glyph in glyphs:
+            loca.append(loca[-1] + len(glyph))
+        graph = ComponentGraph.from_glyf(data, loca)
+        self.assertEqual(graph.components, {1: (0, 2), 2: (3,), 4: (1, 3)})
+        self.assertEqual(graph.closure(4), {0, 1, 2, 3})
+        self.assertEqual(graph.closure(3), set())
+        self.assertEqual(graph.glyph_closure([2, 5]), {2, 3, 5})
+
+    def test_glyph_run(self):
+        metrics = GlyphMetrics.from_hmtx(struct.pack(">HhHh", 500, 10, 600, 20), 2, 2)
+        run = GlyphRun.from_glyphs([1, 0, 1], metrics, [-50, 25])
+        self.assertEqual(list(run), [(1, 600, -50, 0), (0, 500, 25, 550), (1, 600, 0, 1075)])
+        self.assertEqual(run.width, 1655)
+        self.assertEqual(GlyphRun.from_glyphs([], metrics, []).width, 0)
+
+    def test_kern_pairs(self):
+        data = struct.pack(">" + "HHh" * 4, 3, 7, -20, 3, 9, 15, 5, 1, -4, 2, 3, 8)
+        kern = KernPairs.from_format0(data, 4)
+        self.assertEqual(len(kern), 4)
+        self.assertEqual(list(kern.keys), [(2 << 16) | 3, (3 << 16) | 7, (3 << 16) | 9, (5 << 16) | 1])
+        self.assertEqual(kern.value(3, 9), 15)
+        self.assertEqual(kern.value(3, 8), 0)
+        self.assertEqual(kern.value(900, 1), 0)
+        self.assertEqual(kern.get((5, 1)), -4)
+        self.assertIsNone(kern.get((5, 2)))
+        self.assertEqual(kern[(2, 3)], 8)
+        self.assertRaises(KeyError, kern.__getitem__, (4, 4))
+        self.assertTrue((3, 7) in kern)
+        self.assertEqual(list(kern.pairs_for_left(3)), [(7, -20), (9, 15)])
+        self.assertEqual(list(kern.pairs_for_left(4)), [])
+        self.assertEqual(dict(kern.items())[(5, 1)], -4)
+
+        extra = KernPairs.from_format0(struct.pack(">" + "HHh" * 2, 3, 7, 11, 4, 4, 1), 2)
+        merged = kern.merge(extra)
+        self.assertEqual(len(merged), 5)
+        self.assertEqual(merged.value(3, 7), 11)
+        self.assertEqual(merged.value(4, 4), 1)
+
+    def test_kern_classes(self):
+        array_offset = 32
+        data = struct.pack(">3H", 0, 40, 0x0201)
+        data += struct.pack(">4H", 4, 14, 24, array_offset)
+        data += struct.pack(">5H", 10, 3, array_offset, array_offset + 4, 0)
+        data += struct.pack(">4H", 20, 2, 0, 2)
+        data += struct.pack(">4h", -10, 20, 30, -40)
+        kern = KernClasses.from_format2(data)
+        self.assertEqual(kern.value(10, 20), -10)
+        self.assertEqual(kern.value(10, 21), 20)
+        self.assertEqual(kern.value(11, 20), 30)
+        self.assertEqual(kern.value(11, 21), -40)
+        # No class for glyph 12, and glyphs outside the class tables.
+        self.assertEqual(kern.value(12, 20), 0)
+        self.assertEqual(kern.value(9, 20), 0)
+        self.assertEqual(kern.value(10, 22), 0)
+        left, right = kern.class_arrays(22)
+        self.assertEqual(list(left[9:13]), [KernClasses.NO_CLASS, 0, 1, KernClasses.NO_CLASS])
+        self.assertEqual(list(right[19:22]), [KernClasses.NO_CLASS, 0, 1])
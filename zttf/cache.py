@@ -0,0 +1,234 @@
+import hashlib
+import os
+import sys
+from collections import OrderedDict
+from threading import Lock, get_ident
+
+
+class LRUCache(object):
+    """ Thread safe mapping that discards the least recently used entries once it holds
+        more than max_entries entries or max_bytes bytes.
+    """
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=sys.getsizeof):
+        """
+        :param max_entries: Maximum number of entries, or None for no limit.
+        :param max_bytes: Maximum total size of the entries, or None for no limit.
+        :param sizeof: Function returning the size of a (key, value) entry in bytes.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.entries[key][0]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof((key, value))
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            self._evict()
+
+    def pop(self, key, default=None):
+        """ Remove an entry, returning its value. """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return default
+            self.size -= entry[1]
+            return entry[0]
+
+    def get_or_create(self, key, create):
+        """ Return the value for key, calling create() to make it if it is not present.
+            create() is called without holding the lock, so may be called more than once
+            for the same key by different threads.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = create()
+            self.put(key, value)
+        return value
+
+    def _evict(self):
+        while len(self.entries) > 0 and (
+                (self.max_entries is not None and len(self.entries) > self.max_entries) or
+                (self.max_bytes is not None and self.size > self.max_bytes)):
+            key, (value, size) = self.entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """ Return a dict with the number of entries, their size, hits, misses and evictions. """
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+
+def font_identity(font):
+    """ Return a (path, offset, size, mtime) tuple identifying the font, which changes if
+        the file does.
+    """
+    path = os.path.abspath(font.filename)
+    st = os.stat(path)
+    return path, font.start_pos, st.st_size, st.st_mtime
+
+
+def file_hash(path):
+    """ Return the SHA1 hex digest of the contents of a file. """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SubsetCache(object):
+    """ Cache of subset font files, kept in memory and optionally in a directory. Entries
+        are keyed by the font identity and the characters found in the font, with the glyph
+        each maps to, so requests that only differ by repeated characters or characters
+        missing from the font share an entry.
+    """
+    SUFFIX = '.ttf'
+
+    def __init__(self, max_entries=64, max_bytes=None, directory=None, max_disk_bytes=None,
+                 content_hash=False):
+        """
+        :param max_entries: Maximum number of subsets held in memory
+        :param max_bytes: Maximum total size of the subsets held in memory
+        :param directory: Directory to also store the subsets in, or None
+        :param max_disk_bytes: Maximum total size of the files in directory. The least
+                               recently used files are removed once this is exceeded.
+        :param content_hash: Identify fonts by a hash of the file rather than size and mtime.
+        """
+        self.memory = LRUCache(max_entries, max_bytes, sizeof=lambda entry: len(entry[1]))
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.content_hash = content_hash
+        # File hashes, keyed by font identity.
+        self.hashes = {}
+        self.disk_hits = 0
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, font, subset):
+        """ Return the cache key for a subset of font. """
+        ident = font_identity(font)
+        if self.content_hash:
+            if ident not in self.hashes:
+                self.hashes[ident] = file_hash(ident[0])
+            ident = (self.hashes[ident], font.start_pos)
+        index = font.char_index
+        mapping = sorted((c, index[c]) for c in set(subset) if c in index)
+        digest = hashlib.sha1(repr((ident, mapping)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get_subset(self, font, subset):
+        """ Return the subset font file for the characters in subset, creating it if it
+            is not in the cache.
+        :param font: TTFont
+        :param subset: List of characters to include.
+        :return: bytes
+        """
+        key = self.key(font, subset)
+        data = self.memory.get(key)
+        if data is None:
+            data = self._read_file(key)
+            if data is None:
+                # Stored as bytes, as the same object is returned to every caller.
+                data = bytes(font.make_subset(subset).output())
+                self._write_file(key, data)
+            self.memory.put(key, data)
+        return data
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def _read_file(self, key):
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fh:
+                data = fh.read()
+            # The modification time records when the file was last used.
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        self.disk_hits += 1
+        return data
+
+    def _write_file(self, key, data):
+        if self.directory is None:
+            return
+        path = self._path(key)
+        # Unique to the thread, as several may write the same subset at once.
+        tmp = "{}.{}.{}.tmp".format(path, os.getpid(), get_ident())
+        try:
+            with open(tmp, 'wb') as fh:
+                fh.write(data)
+            os.replace(tmp, path)
+        except (IOError, OSError) as e:
+            # The subset is still returned, it just isn't kept on disk.
+            print("Unable to write the subset {}: {}".format(path, e))
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        if self.max_disk_bytes is not None:
+            self._trim_directory()
+
+    def _trim_directory(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, name))
+        total = sum(f[1] for f in files)
+        for mtime, size, name in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+
+    def stats(self):
+        """ Return the memory cache stats, with the number of subsets read from disk. """
+        stats = self.memory.stats()
+        stats['disk_hits'] = self.disk_hits
+        return stats
@@ -0,0 +1,146 @@
+import re
+
+
+class Line(object):
+    """ A line of text produced by line breaking. start and end are indices into the
+        paragraph and width is in font units, matching get_string_width(text).
+    """
+    __slots__ = ('start', 'end', 'text', 'width')
+
+    def __init__(self, start, end, text, width):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.width = width
+
+    def __repr__(self):
+        return "Line({!r}, {})".format(self.text, self.width)
+
+
+class LineBreaker(object):
+    """ Breaks a paragraph into lines at spaces. The paragraph is converted to a
+        GlyphRun once, and the positions in the run are used as prefix sums so the width
+        of any line can be found without measuring it again. Newlines always start a
+        new line. Words wider than the line are placed on a line of their own.
+    """
+    WORD = re.compile(r'\S+')
+
+    def __init__(self, font, text):
+        """
+        :param font: TTFont used for the glyph metrics and kerning
+        :param text: Paragraph to break
+        """
+        self.font = font
+        self.text = text
+        self.run = font.glyph_run(text)
+        lsbs = font.glyph_metrics.lsbs
+        # Words as (start, end) indices, grouped into the blocks separated by newlines.
+        self.blocks = []
+        words = []
+        prev = 0
+        for match in self.WORD.finditer(text):
+            if '\n' in text[prev:match.start()] and len(words) > 0:
+                self.blocks.append(words)
+                words = []
+            words.append((match.start(), match.end()))
+            prev = match.end()
+        if len(words) > 0:
+            self.blocks.append(words)
+        self.lsbs = [lsbs[g] for g in self.run.glyphs]
+
+    def width(self, start, end):
+        """ Width of text[start:end] in font units. """
+        if end <= start:
+            return 0
+        run = self.run
+        return run.positions[end - 1] + run.advances[end - 1] - run.positions[start] - self.lsbs[start]
+
+    def break_lines(self, width, optimal=False):
+        """ Break the paragraph into lines no wider than width.
+        :param width: Maximum line width in font units
+        :param optimal: Choose the breaks for the whole paragraph to minimise the sum of
+                        the squares of the space left on each line (except the last),
+                        rather than filling each line in turn.
+        :return: List of Line
+        """
+        lines = []
+        for words in self.blocks:
+            breaks = self._optimal_breaks(words, width) if optimal else self._greedy_breaks(words, width)
+            for first, last in zip(breaks, breaks[1:]):
+                start, end = words[first][0], words[last - 1][1]
+                lines.append(Line(start, end, self.text[start:end], self.width(start, end)))
+        return lines
+
+    def _greedy_breaks(self, words, width):
+        breaks = [0]
+        for n in range(1, len(words)):
+            if self.width(words[breaks[-1]][0], words[n][1]) > width:
+                breaks.append(n)
+        breaks.append(len(words))
+        return breaks
+
+    def _optimal_breaks(self, words, width):
+        n_words = len(words)
+        # cost[n] is the lowest cost for the words before n, reached from best[n].
+        cost = [0] + [None] * n_words
+        best = [0] * (n_words + 1)
+        for end in range(1, n_words + 1):
+            line_end = words[end - 1][1]
+            for start in range(end - 1, -1, -1):
+                line_width = self.width(words[start][0], line_end)
+                if line_width > width and start < end - 1:
+                    break
+                slack = 0 if end == n_words else max(width - line_width, 0)
+                line_cost = cost[start] + slack * slack
+                if cost[end] is None or line_cost < cost[end]:
+                    cost[end] = line_cost
+                    best[end] = start
+        breaks = [n_words]
+        while breaks[-1] > 0:
+            breaks.append(best[breaks[-1]])
+        return breaks[::-1]
+
+
+def break_lines(font, text, width, optimal=False):
+    """ Break text into lines no wider than width font units. See LineBreaker. """
+    return LineBreaker(font, text).break_lines(width, optimal)
+
+
+def fit_font_size(font, text, width, max_size, min_size=1, height=None, line_height=1.2, step=0.5,
+                  optimal=False):
+    """ Find the largest font size, in steps of step, at which text fits in a box.
+    :param font: TTFont
+    :param text: Text to fit
+    :param width: Width of the box, in the same units as the font size (e.g. points)
+    :param max_size: Largest font size to use
+    :param min_size: Smallest font size to use, returned if the text never fits
+    :param height: Height of the box. If None the text must fit on a single line,
+                   otherwise it is broken into lines of line_height * size.
+    :return: The font size
+    """
+    upem = float(font.units_per_em)
+    if height is None:
+        text_width = font.get_string_width(text)
+        if text_width <= 0:
+            return max_size
+        size = min(max_size, width * upem / text_width)
+        return max(min_size, int(size / step) * step)
+
+    breaker = LineBreaker(font, text)
+
+    def fits(size):
+        limit = width * upem / size
+        lines = breaker.break_lines(limit, optimal)
+        return len(lines) * size * line_height <= height and all(line.width <= limit for line in lines)
+
+    # Binary search over the steps between min_size and max_size.
+    lo, hi = 0, int((max_size - min_size) / step)
+    if fits(min_size + hi * step):
+        return min_size + hi * step
+    while lo < hi - 1:
+        mid = (lo + hi) // 2
+        if fits(min_size + mid * step):
+            lo = mid
+        else:
+            hi = mid
+    return min_size + lo * step
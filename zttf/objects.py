@@ -1,7 +1,9 @@
 # TrueType Font Glyph operators
-from struct import unpack, calcsize
-from zttf.utils import PackedFormat, fixed_version, read_list_uint16, Range, read_list_int16, glyph_more_components, \
-    glyf_skip_format, ttf_checksum
+from array import array
+from bisect import bisect_left
+from struct import unpack, unpack_from, calcsize
+from zttf.utils import PackedFormat, fixed_version, read_list_uint16, Range, glyph_more_components, \
+    glyf_skip_format, ttf_checksum, read_array, read_list_uint32, UINT32, KernPairs, KernClasses
 
 
 TTF_NAMES = {
@@ -31,6 +33,7 @@ TTF_NAMES = {
 
 
 class TTFNameRecord(PackedFormat):
+    __slots__ = ('pos', 'raw', 'value')
     FORMAT = [
         {'name': 'platform_id', 'format': 'H'},
         {'name': 'encoding_id', 'format': 'H'},
@@ -145,9 +148,20 @@ class TTF_kern_subtable(PackedFormat):
             self.offset = fh.tell()
         PackedFormat.__init__(self, fh)
 
+    @property
+    def format(self):
+        return self.coverage >> 8
+
+    @property
+    def is_horizontal_kerning(self):
+        """ True for subtables holding horizontal kerning values, rather than minimum
+            values or cross-stream adjustments.
+        """
+        return self.coverage & 0x07 == 1
 
 
 class TTFOffsetTable(PackedFormat):
+    __slots__ = ()
     FORMAT = [
         {'name': 'tag', 'format': '4s'},
         {'name': 'checksum', 'format': 'I'},
@@ -322,6 +336,8 @@ class TTF_cmap4(PackedFormat):
         return int(n / 2)
 
     class CMAPRange:
+        __slots__ = ('start', 'end', 'delta', 'offset')
+
         def __init__(self, start, end, delta, offset, n_segments):
             self.start = start
             self.end = end
@@ -338,49 +354,89 @@ class TTF_cmap4(PackedFormat):
             if self.offset == 0:
                 return (n + self.delta) & 0xFFFF
             idx = self.offset + n - self.start
-            if 0 < idx < len(glyphs):
+            if not 0 <= idx < len(glyphs):
                 print("Invalid index for glyphs! {}".format(idx))
                 return 0
             return (glyphs[idx] + self.delta) & 0xFFFF
 
     def __init__(self, fh=None, length=None):
-        start = fh.tell() - 4
-        PackedFormat.__init__(self, fh)
+        self.end_codes = array('H')
+        self.start_codes = array('H')
+        self.deltas = array('h')
+        self.range_offsets = array('H')
+        self.glyph_ids = array('H')
+        # Optional 65536 entry character -> glyph table, see enable_dense_map()
+        self.use_dense = False
+        self.dense = None
         if fh is None:
+            PackedFormat.__init__(self)
             return
-        self.ranges = []
+        # The format and length fields have already been read.
+        start = fh.tell() - 4
+        PackedFormat.__init__(self, fh)
 
-        end_codes = read_list_uint16(fh, self.seg_count + 1)
-        if end_codes[self.seg_count] != 0:
+        self.end_codes = read_array('H', fh.read(2 * self.seg_count))
+        if read_list_uint16(fh, 1)[0] != 0:
             print("INVALID pad byte....")
+            self.end_codes = array('H')
             return
-        start_codes = read_list_uint16(fh, self.seg_count)
-        iddelta = read_list_int16(fh, self.seg_count)
-        offset_start = fh.tell()
-        id_offset = read_list_uint16(fh, self.seg_count)
+        self.start_codes = read_array('H', fh.read(2 * self.seg_count))
+        self.deltas = read_array('h', fh.read(2 * self.seg_count))
+        self.range_offsets = read_array('H', fh.read(2 * self.seg_count))
 
         ids_length = int((length - (fh.tell() - start)) / 2)
-        self.glyph_ids = read_list_uint16(fh, ids_length)
+        self.glyph_ids = read_array('H', fh.read(2 * ids_length))
 
-        for n in range(self.seg_count):
-            self.ranges.append(self.CMAPRange(start_codes[n], end_codes[n], iddelta[n], id_offset[n], self.seg_count - n))
+    @property
+    def ranges(self):
+        return [self.CMAPRange(self.start_codes[n], self.end_codes[n], self.deltas[n], self.range_offsets[n],
+                               len(self) - n)
+                for n in range(len(self))]
 
     def __len__(self):
-        return len(self.ranges)
+        return len(self.end_codes)
+
+    def _segment_glyph(self, seg, char):
+        offset = self.range_offsets[seg]
+        if offset == 0:
+            return (char + self.deltas[seg]) & 0xFFFF
+        idx = offset // 2 + char - self.start_codes[seg] - (len(self) - seg)
+        if not 0 <= idx < len(self.glyph_ids) or self.glyph_ids[idx] == 0:
+            return 0
+        return (self.glyph_ids[idx] + self.deltas[seg]) & 0xFFFF
 
     def char_to_glyph(self, char):
-        for r in self.ranges:
-            if not r.contains(char):
-                continue
-            return r.char_to_glyph(char, self.glyph_ids)
+        if self.dense is None and self.use_dense:
+            self.build_dense_map()
+        if self.dense is not None:
+            return self.dense[char] if 0 <= char < 0x10000 else 0
+        seg = bisect_left(self.end_codes, char)
+        if seg == len(self) or self.start_codes[seg] > char:
+            return 0
+        return self._segment_glyph(seg, char)
+
+    def enable_dense_map(self):
+        """ Use a 65536 entry table for lookups. This costs 128k of memory, built on the
+            next lookup, but is worthwhile for fonts that are used heavily.
+        """
+        self.use_dense = True
+
+    def build_dense_map(self):
+        dense = array('H', [0]) * 0x10000
+        for seg in range(len(self)):
+            for char in range(self.start_codes[seg], self.end_codes[seg] + 1):
+                dense[char] = self._segment_glyph(seg, char)
+        self.dense = dense
 
     def as_map(self, max_char):
         cm = {}
-        for r in self.ranges:
-            if r.start > max_char:
-                continue
-            for c in range(r.start, max(r.end, max_char)):
-                cm[c] = r.char_to_glyph(c, self.glyph_ids)
+        for seg in range(len(self)):
+            if self.start_codes[seg] > max_char:
+                break
+            for c in range(self.start_codes[seg], min(self.end_codes[seg], max_char) + 1):
+                glyph = self._segment_glyph(seg, c)
+                if glyph != 0:
+                    cm[c] = glyph
         return cm
 
 
@@ -398,19 +454,73 @@ class TTF_cmap6(PackedFormat):
 
         mapping = read_list_uint16(fh, self.entry_count)
         for n in range(self.entry_count):
-            self.char_map[n] = mapping[n]
-            self.glyph_map.setdefault(mapping[n], []).append(n)
+            self.char_map[self.first_code + n] = mapping[n]
+            self.glyph_map.setdefault(mapping[n], []).append(self.first_code + n)
 
     def __len__(self):
         return len(self.char_map)
 
+    def char_to_glyph(self, char):
+        return self.char_map.get(char, 0)
+
+    def as_map(self, max_char):
+        return {c: g for c, g in self.char_map.items() if c <= max_char and g != 0}
+
+
+class TTF_cmap12(PackedFormat):
+    """ Segmented coverage (format 12) and many to one range (format 13) mappings, which
+        allow characters outside the BMP. The groups are kept as parallel arrays of start
+        code, end code and glyph.
+    """
+    FORMAT = [
+        {'name': 'language', 'format': 'I'},
+        {'name': 'n_groups', 'format': 'I'},
+    ]
+
+    def __init__(self, fh=None, length=None, many_to_one=False):
+        self.many_to_one = many_to_one
+        self.start_codes = array(UINT32)
+        self.end_codes = array(UINT32)
+        self.start_glyphs = array(UINT32)
+        PackedFormat.__init__(self, fh)
+        if fh is None:
+            return
+        groups = read_array(UINT32, fh.read(12 * self.n_groups))
+        self.start_codes = groups[0::3]
+        self.end_codes = groups[1::3]
+        self.start_glyphs = groups[2::3]
+
+    def __len__(self):
+        return len(self.end_codes)
+
+    def _group_glyph(self, grp, char):
+        if self.many_to_one:
+            return self.start_glyphs[grp]
+        return self.start_glyphs[grp] + char - self.start_codes[grp]
+
+    def char_to_glyph(self, char):
+        grp = bisect_left(self.end_codes, char)
+        if grp == len(self) or self.start_codes[grp] > char:
+            return 0
+        return self._group_glyph(grp, char)
+
+    def as_map(self, max_char):
+        cm = {}
+        for grp in range(len(self)):
+            if self.start_codes[grp] > max_char:
+                break
+            for c in range(self.start_codes[grp], min(self.end_codes[grp], max_char) + 1):
+                cm[c] = self._group_glyph(grp, c)
+        return cm
+
 
 class TTF_cmap(PackedFormat):
     FORMAT = [
         {'name': 'version', 'format': 'H'},
         {'name': 'count', 'format': 'H'},
     ]
-    PREFS = [(0, 4), (0, 3), (3, 1)]
+    # Mappings covering the full Unicode range are preferred over BMP only ones.
+    PREFS = [(3, 10), (0, 4), (0, 6), (0, 3), (3, 1)]
 
     def __init__(self, fh=None, length=0):
         self.count = 0
@@ -431,11 +541,18 @@ class TTF_cmap(PackedFormat):
             pos = fh.tell()
 
             fh.seek(start_pos + tbl.offset)
-            tbl.format, length = read_list_uint16(fh, 2)
-            if tbl.format == 4:
-                tbl.map_data = TTF_cmap4(fh, length)
-            elif tbl.format == 6:
-                tbl.map_data = TTF_cmap6(fh, length)
+            tbl.format = read_list_uint16(fh, 1)[0]
+            if tbl.format in (12, 13):
+                # 32-bit formats have a reserved field and 32-bit length.
+                fh.read(2)
+                length = read_list_uint32(fh, 1)[0]
+                tbl.map_data = TTF_cmap12(fh, length, many_to_one=(tbl.format == 13))
+            else:
+                length = read_list_uint16(fh, 1)[0]
+                if tbl.format == 4:
+                    tbl.map_data = TTF_cmap4(fh, length)
+                elif tbl.format == 6:
+                    tbl.map_data = TTF_cmap6(fh, length)
             fh.seek(pos)
 
         # Choose the mapping we are going to use, initially on preferences and
@@ -450,17 +567,10 @@ class TTF_cmap(PackedFormat):
                     self.map_table = t.map_data
                     break
 
-    def char_to_glyph(self, char, fh):
-        for p in self.PREFS:
-            if p in self.tables and self.tables[p].has_map_data:
-                for rng in self.tables[p].map_data.ranges:
-                    if rng.end < char:
-                        continue
-                    if rng.start > char:
-                        continue
-                    return rng.char_to_glyph(char, fh)
-
-        return None
+    def char_to_glyph(self, char):
+        if self.map_table is None:
+            return None
+        return self.map_table.char_to_glyph(char)
 
     def char_map(self, max_char=256):
         return self.map_table.as_map(max_char)
@@ -493,10 +603,7 @@ class TTFcmapTable(PackedFormat):
         return self.map_data is not None and len(self.map_data) > 0
 
     def as_map(self, max_char):
-        cm = {}
-        for r in self.map_data.ranges:
-            cm.update(r.as_map(max_char))
-        return cm
+        return self.map_data.as_map(max_char)
 
 
 class TTF_glyf(PackedFormat):
@@ -530,14 +637,16 @@ class TTF_glyf(PackedFormat):
     def glyph_set(self):
         rqd = set(self.required)
         for c in self.components:
-            rqd.extend(c.required)
+            rqd.update(c.required)
         return sorted(rqd)
 
 
 class TTFCollectionHeader(PackedFormat):
     FORMAT = [
         {'name': 'tag', 'format': '4s'},
-        {'name': 'version', 'format': 'I', 'convert': fixed_version},
+        # For a single font these are the start of the offset table, so the version is
+        # only decoded once the tag has been checked.
+        {'name': 'version', 'format': 'I'},
         {'name': 'count', 'format': 'I'}
     ]
 
@@ -546,15 +655,28 @@ class TTFCollectionHeader(PackedFormat):
         self.offsets = []
         self.is_collection = (self.tag == b'ttcf')
         if self.is_collection:
+            self.version = fixed_version(self.version)
             for i in range(self.count):
                 self.offsets.append(unpack('>I', fh.read(4))[0])
         else:
+            self.version = None
             self.count = 1
             self.offsets = [0]
         if self.version == 2:
             self.dsig_tag, self.dsig_length, self.dsig_offset = unpack("III", fh.read(calcsize('III')))
 
 
+def _value_record_size(value_format):
+    return 2 * bin(value_format & 0xFF).count('1')
+
+
+def _value_x_advance(data, pos, value_format):
+    """ Return the XAdvance from the GPOS value record at pos, 0 if not present. """
+    if not value_format & 0x0004:
+        return 0
+    return unpack_from(">h", data, pos + _value_record_size(value_format & 0x0003))[0]
+
+
 class TTF_gpos(PackedFormat):
     FORMAT = [
         {'name': 'version', 'format': 'I', 'convert': fixed_version},
@@ -562,6 +684,124 @@ class TTF_gpos(PackedFormat):
         {'name': 'feature_list', 'format': 'H'},
         {'name': 'lookup_list', 'format': 'H'},
     ]
+    PAIR_ADJUSTMENT = 2
+    EXTENSION = 9
+
+    @classmethod
+    def kern_lookups(cls, data, n_glyphs, feature=b'kern'):
+        """ Decode the pair adjustment lookups used by a feature.
+        :param data: The complete GPOS table
+        :param n_glyphs: Number of glyphs in the font
+        :param feature: Feature tag
+        :return: List of lookups, each a list of KernPairs / KernClasses subtables in lookup order.
+        """
+        gpos = cls(data=data)
+        indices = set()
+        n_features = unpack_from(">H", data, gpos.feature_list)[0]
+        for n in range(n_features):
+            tag, offset = unpack_from(">4sH", data, gpos.feature_list + 2 + 6 * n)
+            if tag != feature:
+                continue
+            pos = gpos.feature_list + offset
+            n_indices = unpack_from(">H", data, pos + 2)[0]
+            indices.update(unpack_from(">{}H".format(n_indices), data, pos + 4))
+
+        lookups = []
+        for idx in sorted(indices):
+            lookup = gpos.lookup_list + unpack_from(">H", data, gpos.lookup_list + 2 + 2 * idx)[0]
+            lookup_type, flags, n_subtables = unpack_from(">3H", data, lookup)
+            subtables = []
+            for offset in unpack_from(">{}H".format(n_subtables), data, lookup + 6):
+                pos = lookup + offset
+                subtable_type = lookup_type
+                if lookup_type == cls.EXTENSION:
+                    fmt, subtable_type, ext_offset = unpack_from(">HHI", data, pos)
+                    pos += ext_offset
+                if subtable_type != cls.PAIR_ADJUSTMENT:
+                    continue
+                fmt = unpack_from(">H", data, pos)[0]
+                if fmt == 1:
+                    subtables.append(cls._read_pair_glyphs(data, pos))
+                elif fmt == 2:
+                    subtables.append(cls._read_pair_classes(data, pos, n_glyphs))
+            if len(subtables) > 0:
+                lookups.append(subtables)
+        return lookups
+
+    @staticmethod
+    def _read_coverage(data, pos):
+        """ Return the glyphs in a coverage table, in coverage index order. """
+        fmt, count = unpack_from(">2H", data, pos)
+        if fmt == 1:
+            return list(unpack_from(">{}H".format(count), data, pos + 4))
+        glyphs = []
+        for n in range(count):
+            start, end, idx = unpack_from(">3H", data, pos + 4 + 6 * n)
+            glyphs.extend(range(start, end + 1))
+        return glyphs
+
+    @staticmethod
+    def _read_class_def(data, pos):
+        """ Return a dict of glyph -> class for the glyphs listed in a class definition. """
+        fmt = unpack_from(">H", data, pos)[0]
+        if fmt == 1:
+            first, count = unpack_from(">2H", data, pos + 2)
+            return dict(zip(range(first, first + count), unpack_from(">{}H".format(count), data, pos + 6)))
+        classes = {}
+        count = unpack_from(">H", data, pos + 2)[0]
+        for n in range(count):
+            start, end, cls_value = unpack_from(">3H", data, pos + 4 + 6 * n)
+            classes.update((g, cls_value) for g in range(start, end + 1))
+        return classes
+
+    @classmethod
+    def _read_pair_glyphs(cls, data, pos):
+        """ Pair adjustment format 1, individual glyph pairs. """
+        fmt, coverage, format1, format2, n_sets = unpack_from(">5H", data, pos)
+        glyphs = cls._read_coverage(data, pos + coverage)
+        size1 = _value_record_size(format1)
+        record_size = 2 + size1 + _value_record_size(format2)
+        items = []
+        for left, offset in zip(glyphs, unpack_from(">{}H".format(n_sets), data, pos + 10)):
+            pair_set = pos + offset
+            for n in range(unpack_from(">H", data, pair_set)[0]):
+                record = pair_set + 2 + n * record_size
+                right = unpack_from(">H", data, record)[0]
+                value = _value_x_advance(data, record + 2, format1) + \
+                    _value_x_advance(data, record + 2 + size1, format2)
+                items.append(((left << 16) | right, value))
+        # The first record for a pair is the one used, so add them in reverse.
+        return KernPairs.from_items(reversed(items))
+
+    @classmethod
+    def _read_pair_classes(cls, data, pos, n_glyphs):
+        """ Pair adjustment format 2, a matrix of values for classes of glyphs. """
+        fmt, coverage, format1, format2, class_def1, class_def2, n_class1, n_class2 = unpack_from(">8H", data, pos)
+        covered = cls._read_coverage(data, pos + coverage)
+        left_first = min(covered) if len(covered) > 0 else 0
+        left_classes = array('H', [KernClasses.NO_CLASS]) * (max(covered) - left_first + 1 if len(covered) else 0)
+        class1 = cls._read_class_def(data, pos + class_def1)
+        for glyph in covered:
+            left_classes[glyph - left_first] = class1.get(glyph, 0)
+
+        # Every glyph has a second class, 0 unless listed.
+        right_classes = array('H', [0]) * n_glyphs
+        for glyph, cls_value in cls._read_class_def(data, pos + class_def2).items():
+            if glyph < n_glyphs:
+                right_classes[glyph] = cls_value
+
+        start = pos + 16
+        count = n_class1 * n_class2
+        if format1 == 0x0004 and format2 == 0:
+            # Only XAdvance values, so the records are a plain matrix.
+            values = read_array('h', data[start:start + 2 * count])
+        else:
+            size1 = _value_record_size(format1)
+            record_size = size1 + _value_record_size(format2)
+            values = array('h', [_value_x_advance(data, start + n * record_size, format1) +
+                                 _value_x_advance(data, start + n * record_size + size1, format2)
+                                 for n in range(count)])
+        return KernClasses(left_first, left_classes, 0, right_classes, n_class2, values)
 
 
 class OFT_ScriptList(PackedFormat):
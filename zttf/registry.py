@@ -0,0 +1,71 @@
+import os
+from threading import Lock
+
+from zttf.cache import LRUCache
+from zttf.ttfile import TTFile
+
+
+class FontRegistry(object):
+    """ Shares opened font files between users. Files are keyed by their path, size and
+        modification time, which are checked with a stat() on every access so a changed
+        file is opened again. The least recently used files are dropped once there are
+        more than max_fonts of them or their total size is more than max_bytes. Fonts
+        that are dropped remain usable by anyone still holding them.
+    """
+    def __init__(self, max_fonts=32, max_bytes=None, lazy=True):
+        """
+        :param max_fonts: Maximum number of files to keep open
+        :param max_bytes: Maximum total size of the files kept open
+        :param lazy: Parse the tables of each face on first use, see TTFont.
+        """
+        self.lazy = lazy
+        self.files = LRUCache(max_fonts, max_bytes, sizeof=lambda entry: entry[0][1])
+        # The current key for each path, so entries for old versions of a file can be removed.
+        self.keys = {}
+        self.lock = Lock()
+
+    def get_file(self, filename):
+        """ Return the TTFile for filename, opening it if it is not in the registry or has
+            changed since it was opened.
+        """
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime)
+        with self.lock:
+            old = self.keys.get(path)
+            if old is not None and old != key:
+                self.files.pop(old)
+            ttf = self.files.get(key)
+            if ttf is None:
+                ttf = TTFile(path, lazy=self.lazy)
+                self.files.put(key, ttf)
+                # Forget the paths of any files that were dropped to make room.
+                self.keys = {p: k for p, k in self.keys.items() if k in self.files}
+            self.keys[path] = key
+            return ttf
+
+    def get_font(self, filename, face=0):
+        """ Return a face from the file. """
+        return self.get_file(filename).faces[face]
+
+    def find_face(self, filename, name):
+        """ Find a face by name, see TTFile.find_face. """
+        return self.get_file(filename).find_face(name)
+
+    def clear(self):
+        with self.lock:
+            self.keys.clear()
+            self.files.clear()
+
+    def stats(self):
+        """ Return the LRUCache stats for the open files. """
+        return self.files.stats()
+
+
+# Registry shared by the whole process.
+registry = FontRegistry()
+
+
+def get_font(filename, face=0):
+    """ Return a face from the process wide registry. """
+    return registry.get_font(filename, face)
@@ -0,0 +1,205 @@
+import mmap
+import os
+import sys
+from array import array
+from struct import Struct, calcsize, error as struct_error
+from threading import get_ident
+
+from zttf.cache import file_hash
+from zttf.ttf import TTFont
+from zttf.utils import ComponentGraph, GlyphMetrics, KernClasses, KernPairs, Kerning, UINT32, read_array
+
+
+MAGIC = b'ZTTX'
+VERSION = 1
+HEADER = Struct(">4sH20sdQII")
+NAME_SIZE = 16
+ENTRY = Struct(">{}scII".format(NAME_SIZE))
+SUFFIX = '.zttx'
+
+
+def sidecar_path(filename, offset=0, directory=None):
+    """ Return the path of the sidecar for the face at offset in filename. The sidecar is
+        placed next to the font unless a directory is given.
+    """
+    name = "{}.{}{}".format(os.path.basename(filename), offset, SUFFIX)
+    return os.path.join(directory if directory is not None else os.path.dirname(os.path.abspath(filename)), name)
+
+
+def _lookup_arrays(prefix, lookups):
+    """ Return the named arrays for a list of lookups of KernPairs / KernClasses. """
+    arrays = []
+    for n, lookup in enumerate(lookups):
+        for m, subtable in enumerate(lookup):
+            name = "{}/{}/{}/".format(prefix, n, m)
+            if isinstance(subtable, KernPairs):
+                arrays.extend([(name + 'keys', subtable.keys), (name + 'vals', subtable.values)])
+            else:
+                arrays.extend([
+                    (name + 'meta', array(UINT32, [subtable.left_first, subtable.right_first, subtable.n_cols])),
+                    (name + 'left', subtable.left_classes),
+                    (name + 'right', subtable.right_classes),
+                    (name + 'vals', subtable.values),
+                ])
+    return arrays
+
+
+def _read_lookups(prefix, arrays):
+    """ Rebuild a list of lookups from the arrays written by _lookup_arrays. """
+    subtables = {}
+    for name in arrays:
+        parts = name.split('/')
+        if parts[0] == prefix:
+            subtables.setdefault((int(parts[1]), int(parts[2])), "/".join(parts[:3]) + '/')
+    lookups = []
+    for (n, m), name in sorted(subtables.items()):
+        if n == len(lookups):
+            lookups.append([])
+        if name + 'keys' in arrays:
+            lookups[n].append(KernPairs(arrays[name + 'keys'], arrays[name + 'vals']))
+        else:
+            left_first, right_first, n_cols = arrays[name + 'meta']
+            lookups[n].append(KernClasses(left_first, arrays[name + 'left'], right_first, arrays[name + 'right'],
+                                          n_cols, arrays[name + 'vals']))
+    return lookups
+
+
+def write_sidecar(font, path=None):
+    """ Write the derived data for a font (metrics, glyph locations, character map, kerning
+        and compound glyph components) to a sidecar file, so it can be loaded without
+        parsing the font tables again. The file is a header (magic, version, SHA1 of the
+        font file, its mtime and size and the face offset), a directory of (name, typecode,
+        count, offset) entries and then the big endian arrays, each 4 byte aligned.
+    :param font: TTFont
+    :param path: Path of the sidecar, see sidecar_path for the default.
+    :return: The path written
+    """
+    if path is None:
+        path = sidecar_path(font.filename, font.start_pos)
+    st = os.stat(font.filename)
+    chars = sorted(font.char_index)
+    graph = font.component_graph
+    compound = sorted(graph.components)
+    arrays = [
+        ('advances', font.glyph_metrics.advances),
+        ('lsbs', font.glyph_metrics.lsbs),
+        ('loca', font.get_table(b'loca') or array(UINT32)),
+        ('cmap/chars', array(UINT32, chars)),
+        ('cmap/glyphs', array('H', [font.char_index[c] for c in chars])),
+        ('comp/glyphs', array('H', compound)),
+        ('comp/counts', array('H', [len(graph.components[g]) for g in compound])),
+        ('comp/parts', array('H', [c for g in compound for c in graph.components[g]])),
+    ]
+    arrays.extend(_lookup_arrays('kern', [[font.glyph_kern]] + [[c] for c in font.kern_classes]))
+    arrays.extend(_lookup_arrays('kpos', font.kerning.lookups))
+    for name, values in arrays:
+        if len(name) > NAME_SIZE:
+            raise ValueError("The array name '{}' is longer than {} characters".format(name, NAME_SIZE))
+
+    offset = HEADER.size + ENTRY.size * len(arrays)
+    directory = []
+    for name, values in arrays:
+        offset += -offset % 4
+        directory.append((name, values, offset))
+        offset += values.itemsize * len(values)
+
+    output = bytearray(offset)
+    HEADER.pack_into(output, 0, MAGIC, VERSION, bytes.fromhex(file_hash(font.filename)), st.st_mtime, st.st_size,
+                     font.start_pos, len(arrays))
+    for n, (name, values, pos) in enumerate(directory):
+        ENTRY.pack_into(output, HEADER.size + ENTRY.size * n, name.encode('ascii'), values.typecode.encode('ascii'),
+                        len(values), pos)
+        data = array(values.typecode, values)
+        if sys.byteorder == 'little':
+            data.byteswap()
+        output[pos:pos + len(data) * data.itemsize] = data.tobytes()
+
+    # Unique to the thread, as several may load the font at once.
+    tmp = "{}.{}.{}.tmp".format(path, os.getpid(), get_ident())
+    with open(tmp, 'wb') as fh:
+        fh.write(output)
+    os.replace(tmp, path)
+    return path
+
+
+def read_sidecar(path, filename, offset=0):
+    """ Read the arrays from a sidecar file, if it is current for the face. If only the
+        mtime or size of the font differ, the font is checked against the SHA1 and if it
+        is unchanged the header is updated, so the font isn't hashed on every load.
+    :return: Dict of name to array, or None if the sidecar is missing or stale.
+    """
+    try:
+        with open(path, 'rb') as fh:
+            data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    header = None
+    try:
+        if len(data) < HEADER.size:
+            return None
+        magic, version, digest, mtime, size, face_offset, count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION or face_offset != offset:
+            return None
+        st = os.stat(filename)
+        if (st.st_mtime, st.st_size) != (mtime, size):
+            if bytes.fromhex(file_hash(filename)) != digest:
+                return None
+            header = HEADER.pack(magic, version, digest, st.st_mtime, st.st_size, face_offset, count)
+        # The directory and every array must be within the file, as it may have been cut short.
+        if HEADER.size + ENTRY.size * count > len(data):
+            return None
+        arrays = {}
+        for n in range(count):
+            name, typecode, length, pos = ENTRY.unpack_from(data, HEADER.size + ENTRY.size * n)
+            typecode = typecode.decode('ascii')
+            end = pos + length * calcsize(typecode)
+            if end > len(data):
+                return None
+            arrays[name.rstrip(b'\0').decode('ascii')] = read_array(typecode, data[pos:end])
+    except (struct_error, ValueError):
+        return None
+    finally:
+        data.close()
+    if header is not None:
+        try:
+            with open(path, 'r+b') as fh:
+                fh.write(header)
+        except (IOError, OSError) as e:
+            print("Unable to update the sidecar {}: {}".format(path, e))
+    return arrays
+
+
+def load_font(filename, offset=0, directory=None, write=True):
+    """ Open a font using its sidecar if it is current, otherwise parse the font and (if
+        write is True) write a new sidecar for next time.
+    :param filename: Path to the TrueType file
+    :param offset: Offset of the face within the file
+    :param directory: Directory holding the sidecars, see sidecar_path.
+    :param write: Write a sidecar if there isn't a current one.
+    :return: TTFont
+    """
+    path = sidecar_path(filename, offset, directory)
+    arrays = read_sidecar(path, filename, offset)
+    if arrays is None:
+        font = TTFont(filename, offset)
+        if write and font.header.check_version():
+            try:
+                write_sidecar(font, path)
+            except (IOError, OSError, ValueError) as e:
+                print("Unable to write the sidecar {}: {}".format(path, e))
+        return font
+
+    font = TTFont(filename, offset, lazy=True)
+    font.glyph_metrics = GlyphMetrics(arrays['advances'], arrays['lsbs'])
+    font.tables[b'loca'] = arrays['loca']
+    font.char_index = dict(zip(arrays['cmap/chars'], arrays['cmap/glyphs']))
+    components = {}
+    parts = iter(arrays['comp/parts'])
+    for glyph, count in zip(arrays['comp/glyphs'], arrays['comp/counts']):
+        components[glyph] = tuple(next(parts) for n in range(count))
+    font.component_graph = ComponentGraph(components)
+    kern = _read_lookups('kern', arrays)
+    font.glyph_kern = kern[0][0]
+    font.kern_classes = [lookup[0] for lookup in kern[1:]]
+    font.kerning = Kerning(_read_lookups('kpos', arrays))
+    return font
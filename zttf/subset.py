@@ -1,10 +1,13 @@
 from io import BytesIO
-from struct import pack, unpack, calcsize, error as struct_error
+from struct import pack, pack_into, unpack_from, calcsize
 from zttf.objects import TTF_post, TTFHeader, TTFOffsetTable, TTF_kern, TTF_kern_subtable
 from zttf.utils import Range, glyph_more_components, glyf_skip_format, ttf_checksum, binary_search_parameters
 
 
 class TTFSubset:
+    # Most pairs in a format 0 kern subtable whose length still fits in 16 bits.
+    MAX_FORMAT0_PAIRS = (0xFFFF - 14) // 6
+
     def __init__(self, parent, subset):
         self.parent = parent
         self.subset = subset
@@ -23,8 +26,7 @@ class TTFSubset:
         self.required_glyphs = [0]
         self.metrics = []
         self.max_contours = 0
-
-        self.fh = None
+        self.loca_format = 0
 
     def start_table(self, tag, data=None):
         b = BytesIO()
@@ -34,11 +36,8 @@ class TTFSubset:
         return b
 
     def find_glyph_subset(self):
-        for s in self.subset:
-            self.parent.char_to_glyph(s)
-
-        char_to_glyphs = self.parent.get_table(b'cmap').char_map()
-        rqd = []
+        char_to_glyphs = self.parent.char_index
+        rqd = {0}
         for code in self.subset:
             glyph = char_to_glyphs.get(code)
             if glyph is None:
@@ -47,14 +46,9 @@ class TTFSubset:
 #            print("character {} is glyph {}".format(code, glyph))
             self.orig_char_to_glyph[code] = glyph
             self.orig_glyph_to_char.setdefault(glyph, []).append(code)
-            if glyph not in rqd:
-                rqd.append(glyph)
-
-        for glyph in rqd:
-            self.required_glyphs.append(glyph)
-            self.required_glyphs.extend(self.parent.get_glyph_components(glyph))
+            rqd.add(glyph)
 
-        self.required_glyphs.sort()
+        self.required_glyphs = sorted(self.parent.component_graph.glyph_closure(rqd))
 
         self.glyph_map = {}
         for rg in self.required_glyphs:
@@ -67,20 +61,19 @@ class TTFSubset:
 
     def copy_tables(self):
         for tag in [b'name', b'cvt', b'fpgm', b'prep', b'gasp']:
-            if tag in self.parent.tables:
-                buff = self.start_table(tag)
-                tbl = self.parent.header.get_tag(tag)
-                self.fh.seek(tbl.offset)
-                buff.write(self.fh.read(tbl.length))
+            if self.parent.has_table(tag):
+                self.start_table(tag, self.parent.get_binary_table(tag))
 
         new_post = TTF_post()
-        for f in ['italic_angle', 'underline_position', 'Underline_thickness', 'is_fixed_pitch']:
+        # Version 3 has no glyph names.
+        new_post.version_raw = 0x00030000
+        for f in ['italic_angle', 'underline_position', 'underline_thickness', 'is_fixed_pitch']:
             setattr(new_post, f, self.parent.get_table_attr(b'post', f))
         self.start_table(b'post', new_post.as_bytes())
 
         head = self.parent.copy_table(b'head')
         head.checksum_adj = 0
-        head.index_to_loc_format = 0
+        head.index_to_loc_format = self.loca_format
         self.start_table(b'head', head.as_bytes())
 
         hhea = self.parent.copy_table(b'hhea')
@@ -110,6 +103,9 @@ class TTFSubset:
         #   range offset
         self.cmap_ranges = []
         for cc, glyph in sorted(self.char_to_glyph.items()):
+            if cc > 0xFFFE:
+                # Format 4 only covers the BMP and 0xFFFF is used for the end marker.
+                continue
             try:
                 current = self.cmap_ranges[-1]
                 if current is None or not current.is_consecutive(cc, glyph):
@@ -123,11 +119,14 @@ class TTFSubset:
         if self.cmap_ranges == []:
             self.build_cmap_ranges()
         self.cmap_ranges.append(Range(0xffff, 0))
-        self.cmap_ranges[-1].iddelta = 0
+        # The end marker maps 0xFFFF to glyph 0.
+        self.cmap_ranges[-1].iddelta = 1
 
         seg_count = len(self.cmap_ranges)
         src_range, entry_selector = binary_search_parameters(seg_count * 2)
-        length = 16 + 8 * seg_count + len(self.glyph_to_char) + 1
+        # The search range is in bytes, so is twice the number of segments searched.
+        entry_selector -= 1
+        length = 16 + 8 * seg_count
 
         data = [
             0,        # version
@@ -144,41 +143,61 @@ class TTFSubset:
             entry_selector,             # entry selector  log2(src_range / 2)
             seg_count * 2 - src_range,  # range shift ( 2 * seg_count - search_range)
         ]
-        data.extend([r.end for r in self.cmap_ranges])
+        # Range.end is exclusive, the table needs the last character in each range.
+        data.extend([(r.end - 1) & 0xffff for r in self.cmap_ranges])
         data.append(0)
         data.extend([r.start for r in self.cmap_ranges])
 
         buff = self.start_table(b'cmap')
         buff.write(pack(">{}H".format(len(data)), *data))
-        buff.write(pack(">{}h".format(len(self.cmap_ranges)), *[r.iddelta for r in self.cmap_ranges]))
+        buff.write(pack(">{}H".format(len(self.cmap_ranges)), *[r.iddelta & 0xffff for r in self.cmap_ranges]))
         buff.write(pack(">{}H".format(len(self.cmap_ranges)), *[r.offset for r in self.cmap_ranges]))
-        buff.write(pack(">{}H".format(len(self.cmap_ranges)), *[r.start_glyph for r in self.cmap_ranges]))
 
     def get_glyphs(self):
-        locations = []
         self.metrics = []
         self.max_contours = 0
+        self.add_glyph_tables([self.get_glyph(g) for g in self.required_glyphs])
+
+    def get_glyph(self, glyph):
+        """ Return the data for a glyph from the parent font, with any component glyphs
+            changed to their subset ids, and record its metrics.
+        """
+        self.metrics.append(self.parent.glyph_metrics[glyph])
+        data = self.parent.get_glyph_data(glyph)
+        if len(data) == 0:
+            return b''
+        n_contours = unpack_from(">h", data)[0]
+        self.max_contours = max(self.max_contours, n_contours)
+        if n_contours == -1:
+            # need to adjust glyph index...
+            data = bytearray(data)
+            pos = 10
+            while True:
+                flags, next_glyph = unpack_from(">HH", data, pos)
+                pack_into(">H", data, pos + 2, self.glyph_map[next_glyph])
+                pos += 4 + calcsize(glyf_skip_format(flags))
+                if not glyph_more_components(flags):
+                    break
+        return data
+
+    def add_glyph_tables(self, glyphs):
+        """ Add the glyf, loca and hmtx tables for the glyph data, in subset order. """
+        locations = []
         buff = self.start_table(b'glyf')
-        for g in self.required_glyphs:
-            locations.append(int(buff.tell() / 2))
-            data = self.parent.get_glyph_data(g)
-            if data == b'':
-                continue
-            n_contours = unpack(">h", data[:2])[0]
-            self.max_contours = max(self.max_contours, n_contours)
-            if n_contours == -1:
-                # need to adjust glyph index...
-                pos = 10
-                while True:
-                    flags, next_glyph = unpack(">HH", data[pos: pos + 4])
-                    data = data[:pos + 2] + pack(">H", self.glyph_map[next_glyph]) + data[pos+4:]
-                    pos += 4 + calcsize(glyf_skip_format(flags))
-                    if not glyph_more_components(flags):
-                        break
+        for data in glyphs:
+            locations.append(buff.tell())
             buff.write(data)
-            self.metrics.append(self.parent.glyph_metrics[g])
+            # Short loca offsets are halved, so glyphs must start on even offsets.
+            if len(data) % 2:
+                buff.write(b'\0')
+        locations.append(buff.tell())
         loca = self.start_table(b'loca')
-        loca.write(pack(">{}H".format(len(locations)), *locations))
+        if locations[-1] <= 0x1FFFE:
+            self.loca_format = 0
+            loca.write(pack(">{}H".format(len(locations)), *[n // 2 for n in locations]))
+        else:
+            self.loca_format = 1
+            loca.write(pack(">{}I".format(len(locations)), *locations))
 
         hmtx = self.start_table(b'hmtx')
         for m in self.metrics:
@@ -186,37 +205,119 @@ class TTFSubset:
 
     def add_kern_data(self):
         entries = {}
-
-        for k, diff in self.parent.glyph_kern.items():
-            if k[0] not in self.required_glyphs or k[1] not in self.required_glyphs:
-                continue
-#            print("mapping {} to ({}, {})".format(k, self.glyph_map[k[0]], self.glyph_map[k[1]]))
-            entries[(self.glyph_map[k[0]], self.glyph_map[k[1]])] = diff
+        glyph_kern = self.parent.glyph_kern
+        glyph_map = self.glyph_map
+        # Only the pairs for the required left glyphs are looked at, using the index of
+        # pairs by left glyph, so the cost depends on the subset rather than the font.
+        for left in self.required_glyphs:
+            new_left = glyph_map[left]
+            for right, diff in glyph_kern.pairs_for_left(left):
+                new_right = glyph_map.get(right)
+                if new_right is not None:
+                    entries[(new_left, new_right)] = diff
         if len(entries) == 0:
             return
 
+        # Use whichever subtable format is smaller, of those able to hold the pairs.
+        subtables = [st for st in (self.kern_format0(entries), self.kern_format2(entries)) if st is not None]
+        if len(subtables) > 0:
+            subtables = [min(subtables, key=len)]
+        else:
+            # Too many pairs for one subtable, so split them between format 0 subtables.
+            # The pairs are distinct, so the values added from each subtable are unchanged.
+            pairs = sorted(entries.items())
+            subtables = [self.kern_format0(dict(pairs[n:n + self.MAX_FORMAT0_PAIRS]))
+                         for n in range(0, len(pairs), self.MAX_FORMAT0_PAIRS)]
         kern = self.start_table(b'kern')
         kh = TTF_kern()
         kh.version = 0
-        kh.num_tables = 1
+        kh.num_tables = len(subtables)
         kern.write(kh.as_bytes())
+        for subtable in subtables:
+            kern.write(subtable)
+
+    @staticmethod
+    def kern_subtable(fmt, body):
         st = TTF_kern_subtable()
-        st.length = len(st) + 6 * len(entries) + 8
+        # The length is only 16 bits, readers use the pair count for large subtables.
+        st.length = (len(st) + len(body)) & 0xFFFF
         st.version = 0
-        st.coverage = 1
-        kern.write(st.as_bytes())
-        kern.write(pack(">H", len(entries)))
-        src_rng, sel = binary_search_parameters(len(entries))
-        kern.write(pack(">HHH", src_rng, sel, len(entries) - sel * calcsize(">HHH")))
-        for key, diff in entries.items():
-            kern.write(pack(">HHh", key[0], key[1], diff))
+        st.coverage = 1 | (fmt << 8)
+        return st.as_bytes() + body
+
+    @classmethod
+    def kern_format0(cls, entries):
+        """ Return a format 0 kern subtable, with the pairs sorted so they can be found
+            by binary search.
+        :param entries: Dict of (left, right) glyph pairs to values
+        :return: The subtable, or None if the search fields don't fit in 16 bits.
+        """
+        n_pairs = len(entries)
+        src_rng, sel = binary_search_parameters(n_pairs)
+        if 6 * src_rng > 0xFFFF:
+            return None
+        body = pack(">4H", n_pairs, 6 * src_rng, sel, 6 * (n_pairs - src_rng))
+        pairs = []
+        for (left, right), diff in sorted(entries.items()):
+            pairs.extend((left, right, diff))
+        body += pack(">" + "HHh" * n_pairs, *pairs)
+        return cls.kern_subtable(0, body)
+
+    @classmethod
+    def kern_format2(cls, entries):
+        """ Return a format 2 kern subtable, grouping the glyphs with the same kerning
+            into classes. Class 0 is used for glyphs without kerning.
+        :param entries: Dict of (left, right) glyph pairs to values
+        :return: The subtable, or None if the offsets don't fit in 16 bits.
+        """
+        columns = {}
+        for (left, right), diff in entries.items():
+            columns.setdefault(right, []).append((left, diff))
+        right_classes = {}
+        signatures = {}
+        for right in sorted(columns):
+            signature = tuple(sorted(columns[right]))
+            right_classes[right] = signatures.setdefault(signature, len(signatures) + 1)
+        n_cols = len(signatures) + 1
+
+        rows = {}
+        for (left, right), diff in entries.items():
+            rows.setdefault(left, []).append((right_classes[right], diff))
+        left_classes = {}
+        signatures = {}
+        for left in sorted(rows):
+            signature = tuple(sorted(rows[left]))
+            left_classes[left] = signatures.setdefault(signature, len(signatures) + 1)
+        n_rows = len(signatures) + 1
+
+        row_width = 2 * n_cols
+        left_first, left_last = min(left_classes), max(left_classes)
+        right_first, right_last = min(right_classes), max(right_classes)
+        left_offset = 14
+        right_offset = left_offset + 4 + 2 * (left_last - left_first + 1)
+        array_offset = right_offset + 4 + 2 * (right_last - right_first + 1)
+        # Checked before the matrix is built, as it is large when the offsets overflow.
+        if array_offset + row_width * (n_rows - 1) > 0xFFFF or row_width > 0xFFFF:
+            return None
+        matrix = [0] * (n_rows * n_cols)
+        for signature, row in signatures.items():
+            for col, diff in signature:
+                matrix[row * n_cols + col] = diff
+
+        # Left class values are offsets to the row, right values offsets within the row.
+        left_values = [array_offset + row_width * left_classes.get(g, 0) for g in range(left_first, left_last + 1)]
+        right_values = [2 * right_classes.get(g, 0) for g in range(right_first, right_last + 1)]
+        body = pack(">4H", row_width, left_offset, right_offset, array_offset)
+        body += pack(">{}H".format(2 + len(left_values)), left_first, len(left_values), *left_values)
+        body += pack(">{}H".format(2 + len(right_values)), right_first, len(right_values), *right_values)
+        body += pack(">{}h".format(len(matrix)), *matrix)
+        return cls.kern_subtable(2, body)
 
     # Put the TTF file together
-    def output(self):
-        """ Generate a binary based on the subset we have been given. """
-
-        self.fh = open(self.parent.filename, 'rb')
-        self.fh.seek(self.parent.start_pos)
+    def output(self, fh=None):
+        """ Generate a binary based on the subset we have been given.
+        :param fh: Optional file object to write the font to, see write_font.
+        """
 
         self.find_glyph_subset()
         self.add_kern_data()
@@ -224,48 +325,126 @@ class TTFSubset:
         self.get_glyphs()
         self.copy_tables()
 #        self.dump_tables()
-
-        self.fh.close()
-
+        return self.write_font(fh)
+
+    def write_font(self, fh=None):
+        """ Combine the tables into a font file.
+        :param fh: Writable file object to write the font to. If None the font is
+                   written into a bytearray of the final size.
+        :return: The bytearray, or the number of bytes written to fh.
+        """
         header = TTFHeader()
         header.num_tables = len(self.tables)
         header.version_raw = 0x00010000
-
-        output = BytesIO()
         header.search_range, header.entry_selector = binary_search_parameters(len(self.tables))
         header.search_range *= 16
         header.range_shift = len(self.tables) * 16 - header.search_range
-        output.write(header.as_bytes())
+        directory = bytearray(header.as_bytes())
 
-        head_offset = 0
-        offset = output.tell() + 16 * len(self.tables)
+        # Table data without copying, except head which has the checksum adjustment patched in.
+        # The views must be released before the tables can be written to again.
         sorted_tables = sorted(self.tables.keys())
-        for tag in sorted_tables:
-            if tag == b'head':
-                head_offset = offset
-            tbl = TTFOffsetTable()
-            tbl.tag = tag
-            tbl.offset = offset
-            data = self.tables[tag].getvalue()
-            tbl.length = len(data)
-            tbl.calculate_checksum(data)
-            offset += tbl.padded_length()
-            output.write(tbl.as_bytes())
-
-        for tag in sorted_tables:
-            data = self.tables[tag].getvalue()
-            data += b'\0' * (len(data) % 4)
-            output.write(data)
-
-        checksum = 0xB1B0AFBA - ttf_checksum(output.getvalue())
-        data = output.getvalue()
+        tables = [self.tables[tag].getbuffer() for tag in sorted_tables]
         try:
-            data = data[:head_offset + 8] + pack(">I", checksum) + data[head_offset + 12:]
-        except struct_error:
-            data = data[:head_offset + 8] + pack(">i", checksum) + data[head_offset + 12:]
-        return data
+            head = None
+            if b'head' in self.tables:
+                head = bytearray(tables[sorted_tables.index(b'head')])
+                pack_into(">I", head, 8, 0)
+                tables[sorted_tables.index(b'head')].release()
+                tables[sorted_tables.index(b'head')] = head
+
+            offset = len(directory) + 16 * len(self.tables)
+            checksum = 0
+            for tag, data in zip(sorted_tables, tables):
+                tbl = TTFOffsetTable()
+                tbl.tag = tag
+                tbl.offset = offset
+                tbl.length = len(data)
+                tbl.calculate_checksum(data)
+                checksum += tbl.checksum
+                offset += tbl.padded_length()
+                directory += tbl.as_bytes()
+            # Every table starts on a 4 byte boundary, so the checksum of the file is the sum
+            # of the table checksums and the checksum of the directory.
+            if head is not None:
+                pack_into(">I", head, 8, (0xB1B0AFBA - checksum - ttf_checksum(directory)) & 0xFFFFFFFF)
+
+            if fh is None:
+                output = bytearray(offset)
+                pos = len(directory)
+                output[:pos] = directory
+                for data in tables:
+                    output[pos:pos + len(data)] = data
+                    pos += len(data) + 3 & ~3
+                return output
+            fh.write(directory)
+            for data in tables:
+                fh.write(data)
+                fh.write(b'\0' * (-len(data) % 4))
+            return offset
+        finally:
+            for data in tables:
+                if isinstance(data, memoryview):
+                    data.release()
 
     def dump_tables(self):
         for n in sorted(self.tables):
             print("{} {} bytes".format(n, self.tables[n].tell()))
 
+
+class TTFSubsetSession(TTFSubset):
+    """ A subset that characters can be added to as they are found, e.g. page by page
+        while writing a document. Glyphs are numbered in the order they are added, so the
+        subset glyph ids already used remain valid as the subset grows, and only the new
+        glyphs are read from the parent font.
+    """
+    def __init__(self, parent, subset=None):
+        TTFSubset.__init__(self, parent, [])
+        self.glyph_map = {0: 0}
+        # Subset glyph data, in subset glyph order.
+        self.glyph_data = [self.get_glyph(0)]
+        if subset is not None:
+            self.add(subset)
+
+    def add(self, subset):
+        """ Add characters to the subset.
+        :param subset: List of characters to add.
+        :return: List of the subset glyph ids for the characters, None for any not in the font.
+        """
+        char_index = self.parent.char_index
+        new_glyphs = []
+        for code in subset:
+            if code in self.orig_char_to_glyph:
+                continue
+            glyph = char_index.get(code)
+            if glyph is None:
+                print("Unknown character in parent mapping: {}".format(code))
+                continue
+            self.subset.append(code)
+            self.orig_char_to_glyph[code] = glyph
+            self.orig_glyph_to_char.setdefault(glyph, []).append(code)
+            for g in [glyph] + self.parent.get_glyph_components(glyph):
+                if g not in self.glyph_map:
+                    self.glyph_map[g] = len(self.glyph_map)
+                    self.required_glyphs.append(g)
+                    new_glyphs.append(g)
+            self.char_to_glyph[code] = self.glyph_map[glyph]
+            self.glyph_to_char.setdefault(self.glyph_map[glyph], []).append(code)
+
+        # All the new glyphs have ids now, so compound glyphs can be remapped.
+        for g in new_glyphs:
+            self.glyph_data.append(self.get_glyph(g))
+        return [self.char_to_glyph.get(code) for code in subset]
+
+    def output(self, fh=None):
+        """ Generate a binary containing the glyphs added so far. More characters can
+            still be added afterwards.
+        :param fh: Optional file object to write the font to, see write_font.
+        """
+        self.tables = {}
+        self.cmap_ranges = []
+        self.add_kern_data()
+        self.add_cmap_table()
+        self.add_glyph_tables(self.glyph_data)
+        self.copy_tables()
+        return self.write_font(fh)
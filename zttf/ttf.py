@@ -1,24 +1,74 @@
+import mmap
+import sys
+from array import array
 from copy import copy
-from struct import calcsize, unpack
+from struct import calcsize, unpack, unpack_from, error as struct_error
+from threading import RLock
 
-from zttf.objects import TTFHeader, TTF_head, TTF_name, TTF_hhea, TTF_os2, TTF_post, TTF_maxp, TTF_cmap, TTF_glyf, \
-    TTF_kern
-from zttf.subset import TTFSubset
-from zttf.utils import read_list_uint16, read_list_uint32
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from zttf.objects import TTFHeader, TTF_head, TTF_name, TTF_hhea, TTF_os2, TTF_post, TTF_maxp, TTF_cmap, \
+    TTF_kern, TTF_gpos
+from zttf.cache import LRUCache
+from zttf.subset import TTFSubset, TTFSubsetSession
+from zttf.utils import BufferReader, ComponentGraph, GlyphMetrics, GlyphRun, KernClasses, KernPairs, Kerning, \
+    UINT32, read_array, read_list_uint16, read_list_uint32
 
 
 class TTFont(object):
-    def __init__(self, filename, offset):
+    # Classes used to decode the tables we understand.
+    TABLE_CLASSES = {
+        b'head': TTF_head,
+        b'name': TTF_name,
+        b'hhea': TTF_hhea,
+        b'os2': TTF_os2,
+        b'post': TTF_post,
+        b'maxp': TTF_maxp,
+        b'cmap': TTF_cmap,
+        b'kern': TTF_kern,
+    }
+    # Tables and attributes that are derived from other tables, with the method
+    # used to create them.
+    DERIVED_TABLES = {
+        b'loca': 'get_loca',
+    }
+    DERIVED_DATA = {
+        'glyph_metrics': 'get_hmtx',
+        'glyph_kern': 'get_kern_data',
+        'kern_classes': 'get_kern_data',
+        'kerning': 'get_kerning',
+        'char_index': 'get_char_index',
+        'component_graph': 'get_component_graph',
+    }
+
+    def __init__(self, filename, offset, use_mmap=False, lazy=False, data=None, table_cache=None):
+        """ Parse the font found at offset within filename.
+        :param filename: Path to the TrueType file.
+        :param offset: Offset of the font header within the file (non-zero for collections).
+        :param use_mmap: Map the file into memory and read all tables and glyphs from the mapping.
+        :param lazy: Only read the table directory now, with each table being parsed on first use.
+        :param data: Buffer containing the whole file, which is used instead of opening it. The
+                     buffer is owned by the caller and not closed by the font.
+        :param table_cache: Dict used to share parsed tables with other fonts in the same file.
+        """
+        # Held while tables are parsed on demand, as the file position is shared and
+        # a font may be used by several threads.
+        self.lock = RLock()
         self.header = None
         self.tables = {}
         self.filename = filename
         self.start_pos = offset
 
-        self.idx_format = 0
-        self.n_glyphs = 0
-        self.glyph_metrics = []
-        self.glyph_kern = {}
-
+        self.use_mmap = use_mmap
+        self.lazy = lazy
+        self.data = data
+        self.owns_data = data is None
+        self.table_cache = table_cache
+        self.glyph_lookup = None
+        self.cache = None
         self.file_handle = None
         self.parse()
 
@@ -26,24 +76,22 @@ class TTFont(object):
         self._open()
         self.header = self._read_class(TTFHeader)
         if not self.header.check_version():
+            self.glyph_metrics = GlyphMetrics()
+            self.glyph_kern = KernPairs()
+            self.kern_classes = []
+            self.kerning = Kerning()
+            return
+        if self.lazy:
+            self._close()
             return
 
-        self.get_table(b'head', TTF_head)
-        self.get_table(b'name', TTF_name)
-        self.get_table(b'hhea', TTF_hhea)
-        self.get_table(b'os2', TTF_os2)
-        self.get_table(b'post', TTF_post)
-        self.get_table(b'maxp', TTF_maxp)
-        self.get_table(b'cmap', TTF_cmap)
-        self.get_table(b'kern', TTF_kern)
-
-        self.idx_format = self.get_table_attr(b'head', 'index_to_loc_format')
-        self.n_glyphs = self.get_table_attr(b'maxp', 'num_glyphs', 0)
+        for tag in self.TABLE_CLASSES:
+            self.get_table(tag)
 
         self.get_hmtx()
         self.get_loca()
-        if b'kern' in self.tables:
-            self.get_kern_data()
+        self.get_kern_data()
+        self.get_kerning()
 
         self._close()
 
@@ -66,6 +114,11 @@ class TTFont(object):
     }
 
     def __getattr__(self, item):
+        if item in self.DERIVED_DATA:
+            with self.lock:
+                if item not in self.__dict__:
+                    getattr(self, self.DERIVED_DATA[item])()
+            return self.__dict__[item]
         if item in self.COMMON_DATA:
             how = self.COMMON_DATA[item]
             if how[0] == b'name':
@@ -74,6 +127,14 @@ class TTFont(object):
                 return self.get_table_attr(*how[:3])
             return self.get_table_attr(*how)
 
+    @property
+    def idx_format(self):
+        return self.get_table_attr(b'head', 'index_to_loc_format', 0)
+
+    @property
+    def n_glyphs(self):
+        return self.get_table_attr(b'maxp', 'num_glyphs', 0)
+
     @property
     def stemv(self):
         return 50 + int(pow((self.weight_class / 65.0), 2))
@@ -82,44 +143,215 @@ class TTFont(object):
     def italic(self):
         return self.italic_angle != 0
 
+    def enable_cache(self, max_entries=4096, max_bytes=None):
+        """ Cache the glyphs, widths and glyph runs for strings, discarding the least
+            recently used once there are more than max_entries or they use more than
+            max_bytes. The font, and so the cache, can be shared by several threads.
+        """
+        self.cache = LRUCache(max_entries, max_bytes, sizeof=_cache_entry_size)
+
+    def disable_cache(self):
+        self.cache = None
+
+    def cache_stats(self):
+        """ Return the LRUCache stats dict, or None if the cache is not enabled. """
+        return self.cache.stats() if self.cache is not None else None
+
+    def string_to_glyphs(self, string):
+        """ Return the list of glyphs for the characters in string. """
+        if self.cache is not None:
+            return list(self.cache.get_or_create((b'glyphs', string), lambda: tuple(self._string_to_glyphs(string))))
+        return self._string_to_glyphs(string)
+
+    def _string_to_glyphs(self, string):
+        index = self.char_index
+        return [index.get(ord(c), 0) for c in string]
+
     def get_string_width(self, string):
-        width = 0
-        for n in range(len(string)):
-            glyph = self.char_to_glyph(ord(string[n]))
-            (aw, lsb) = self.glyph_metrics[glyph]
-            width += aw
-            if n == 0:
-                width -= lsb
-            elif n < len(string) - 1:
-                glyf2 = self.char_to_glyph(ord(string[n + 1]))
-                width += self.glyph_kern.get((glyph, glyf2), 0)
-        return width
+        if self.cache is not None:
+            return self.cache.get_or_create((b'width', string),
+                                            lambda: self._glyphs_width(self._string_to_glyphs(string)))
+        return self._glyphs_width(self._string_to_glyphs(string))
 
     def get_char_width(self, char):
         if isinstance(char, str):
             char = ord(char)
         idx = self.char_to_glyph(char)
-        if 0 < idx < len(self.glyph_metrics):
+        if not 0 <= idx < len(self.glyph_metrics):
             idx = 0
         return self.glyph_metrics[idx][0]
 
+    def glyph_run(self, string):
+        """ Convert a string to a GlyphRun, giving the glyph ids, advances, kerning and
+            positions needed to place the glyphs, as well as the width of the string.
+            When the cache is enabled the same GlyphRun is returned for repeated strings.
+        """
+        if self.cache is not None:
+            return self.cache.get_or_create((b'run', string), lambda: self._glyph_run(string))
+        return self._glyph_run(string)
+
+    def _glyph_run(self, string):
+        glyphs = self._string_to_glyphs(string)
+        return GlyphRun.from_glyphs(glyphs, self.glyph_metrics, self._kern_values(glyphs))
+
+    def _glyphs_width(self, glyphs):
+        if len(glyphs) == 0:
+            return 0
+        advances = self.glyph_metrics.advances
+        width = sum([advances[g] for g in glyphs]) - self.glyph_metrics.lsbs[glyphs[0]]
+        return width + sum(self._kern_values(glyphs))
+
+    def _kern_values(self, glyphs):
+        """ Return the kerning between each pair of adjacent glyphs. """
+        lookups = self.kerning.lookups
+        if len(lookups) == 1 and len(lookups[0]) == 1:
+            # A single subtable, so there is no need to check which one applies.
+            value = lookups[0][0].value
+        else:
+            value = self.kerning.value
+        return [value(left, right) for left, right in zip(glyphs, glyphs[1:])]
+
+    def measure_many(self, strings, use_numpy=None):
+        """ Measure the widths of a batch of strings. Each string is converted to glyphs
+            once and, if numpy is available, the advances and kerning are summed for all
+            strings together.
+        :param strings: Sequence of strings to measure
+        :param use_numpy: Use numpy for the calculations. Default is to use it when installed.
+        :return: Widths in font units, as a numpy array if numpy was used, otherwise an array.array
+        """
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        if use_numpy:
+            return self._measure_numpy(strings)
+        return array('l', [self.get_string_width(s) for s in strings])
+
+    def _measure_numpy(self, strings):
+        n_runs = len(strings)
+        lengths = numpy.fromiter((len(s) for s in strings), dtype=numpy.intp, count=n_runs)
+        # Convert all the characters at once, through a table indexed by character.
+        chars = numpy.frombuffer(''.join(strings).encode('utf-32-le', 'surrogatepass'), dtype='<u4')
+        lookup = self._glyph_lookup()
+        glyphs = lookup[numpy.minimum(chars, len(lookup) - 1)].astype(numpy.int64)
+        advances = numpy.frombuffer(self.glyph_metrics.advances, dtype=numpy.uint16)
+        lsbs = numpy.frombuffer(self.glyph_metrics.lsbs, dtype=numpy.int16)
+
+        # Index of the string each glyph belongs to, used to sum per string.
+        owner = numpy.repeat(numpy.arange(n_runs), lengths)
+        widths = numpy.bincount(owner, weights=advances[glyphs], minlength=n_runs)
+        used = lengths > 0
+        widths[used] -= lsbs[glyphs[(numpy.cumsum(lengths) - lengths)[used]]]
+
+        if len(glyphs) < 2:
+            return widths.astype(numpy.int64)
+        # Pairs of adjacent glyphs within the same string.
+        same = owner[:-1] == owner[1:]
+        left_glyphs = glyphs[:-1]
+        right_glyphs = glyphs[1:]
+        for lookup in self.kerning.lookups:
+            # Only the first subtable in a lookup that covers a pair is used.
+            done = ~same
+            for subtable in lookup:
+                if isinstance(subtable, KernPairs):
+                    idx, values = self._numpy_pair_values(subtable, left_glyphs, right_glyphs, done)
+                else:
+                    idx, values = self._numpy_class_values(subtable, left_glyphs, right_glyphs, done,
+                                                           len(advances))
+                done[idx] = True
+                widths += numpy.bincount(owner[idx], weights=values, minlength=n_runs)
+        return widths.astype(numpy.int64)
+
+    @staticmethod
+    def _numpy_pair_values(pairs, left, right, done):
+        """ Return the indices of the glyph pairs not yet done that are in pairs, and their values. """
+        if len(pairs.keys) == 0:
+            return numpy.zeros(0, dtype=numpy.intp), numpy.zeros(0)
+        keys = numpy.frombuffer(pairs.keys, dtype=numpy.uint32).astype(numpy.int64)
+        values = numpy.frombuffer(pairs.values, dtype=numpy.int16)
+        # Only search for pairs whose left glyph has kerning.
+        kerned = numpy.zeros(max(int(left.max()), int(keys[-1] >> 16)) + 1, dtype=bool)
+        kerned[keys >> 16] = True
+        idx = numpy.flatnonzero(kerned[left] & ~done)
+        wanted = (left[idx] << 16) | right[idx]
+        pos = numpy.minimum(numpy.searchsorted(keys, wanted), len(keys) - 1)
+        found = keys[pos] == wanted
+        return idx[found], values[pos[found]]
+
+    @staticmethod
+    def _numpy_class_values(classes, left, right, done, n_glyphs):
+        """ Return the indices of the glyph pairs not yet done that have classes, and their values. """
+        left_classes, right_classes = classes.class_arrays(n_glyphs)
+        rows = numpy.frombuffer(left_classes, dtype=numpy.uint16)[left].astype(numpy.int64)
+        cols = numpy.frombuffer(right_classes, dtype=numpy.uint16)[right].astype(numpy.int64)
+        idx = numpy.flatnonzero(~done & (rows != classes.NO_CLASS) & (cols != classes.NO_CLASS))
+        matrix = numpy.frombuffer(classes.values, dtype=numpy.int16)
+        return idx, matrix[rows[idx] * classes.n_cols + cols[idx]]
+
+    def _glyph_lookup(self):
+        """ numpy array mapping each character up to the highest in the cmap to its glyph.
+            The final entry is always 0 and used for characters past the end.
+        """
+        if self.glyph_lookup is None:
+            size = max(self.char_index) + 2 if len(self.char_index) > 0 else 1
+            lookup = numpy.zeros(size, dtype=numpy.uint16)
+            lookup[numpy.fromiter(self.char_index.keys(), dtype=numpy.int64)] = list(self.char_index.values())
+            self.glyph_lookup = lookup
+        return self.glyph_lookup
+
     # Internal Table Functions
+    def has_table(self, tag):
+        return self.header.get_tag(tag) is not None
+
     def get_table(self, tag, obj_class=None):
+        """ Return the parsed table for tag, parsing it on first use.
+        :param tag: Table tag
+        :param obj_class: Class to parse the table with. If not supplied the class from
+                          TABLE_CLASSES is used.
+        :return: Table object or None if the table isn't present or can't be parsed.
+        """
         tbl_obj = self.tables.get(tag)
-        if tbl_obj is None and obj_class is not None:
-            tbl = self.header.get_tag(tag)
-            if tbl is None:
-                return None
+        if tbl_obj is not None:
+            return tbl_obj
+        with self.lock:
+            tbl_obj = self.tables.get(tag)
+            if tbl_obj is None and tag in self.DERIVED_TABLES:
+                getattr(self, self.DERIVED_TABLES[tag])()
+                return self.tables.get(tag)
+            if obj_class is None:
+                obj_class = self.TABLE_CLASSES.get(tag)
+            if tbl_obj is None and obj_class is not None:
+                tbl = self.header.get_tag(tag)
+                if tbl is None:
+                    return None
+                tbl_obj = self._shared((tag, tbl.offset, tbl.length, obj_class),
+                                       lambda: self._read_table(tbl, obj_class))
+                self.tables[tag] = tbl_obj
+            return tbl_obj
+
+    def _read_table(self, tbl, obj_class):
+        with self.lock:
             orig_pos = self._seek(tbl.offset)
             tbl_obj = self._read_class(obj_class, tbl.length)
-            self.tables[tag] = tbl_obj
             self._seek(orig_pos)
+            self._release()
         return tbl_obj
 
+    def _shared(self, key, create):
+        """ Return the object for key from the shared table cache, calling create() to
+            make it if required. Fonts in a collection share a cache, so tables they have
+            in common are only parsed once.
+        """
+        if self.table_cache is None:
+            return create()
+        obj = self.table_cache.get(key)
+        if obj is None:
+            obj = self.table_cache[key] = create()
+        return obj
+
     def get_table_attr(self, tbl, attr, default=None):
-        if tbl not in self.tables:
+        tbl_obj = self.get_table(tbl)
+        if tbl_obj is None:
             return default
-        return getattr(self.tables[tbl], attr, default)
+        return getattr(tbl_obj, attr, default)
 
     def get_name_attr(self, n_attr, default=None):
         """ Return the string from the name table with the number given.
@@ -127,9 +359,10 @@ class TTFont(object):
         :param default: Return value if no entry is available (deafult is None).
         :return: String from name table. default if not available
         """
-        if b'name' not in self.tables:
+        name = self.get_table(b'name')
+        if name is None:
             return default
-        return self.tables[b'name'].get_name(n_attr, default)
+        return name.get_name(n_attr, default)
 
     def copy_table(self, tag):
         tbl = self.get_table(tag)
@@ -143,65 +376,126 @@ class TTFont(object):
         """ Read the glyph metrics. """
         n_metrics = self.get_table_attr(b'hhea', 'number_of_metrics')
 
-        offset = self._get_table_offset(b'hmtx')
-        if offset == 0:
+        tbl = self.header.get_tag(b'hmtx')
+        if tbl is None:
+            self.glyph_metrics = GlyphMetrics()
             return False
-        self._seek(offset)
-        aw = 0
-        for n in range(n_metrics):
-            aw, lsb = unpack(">Hh", self.file_handle.read(4))
-            self.glyph_metrics.append((aw, lsb))
-        # Now we have read the aw and lsb for specific glyphs, we need to read additional
-        # lsb data.
-        extra = self.n_glyphs - n_metrics
-        if extra > 0:
-            lsbs = self._read_list_int16(extra)
-            for n in range(extra):
-                self.glyph_metrics.append((aw, lsbs[n]))
+        self.glyph_metrics = self._shared((b'hmtx', tbl.offset, n_metrics, self.n_glyphs),
+                                          lambda: GlyphMetrics.from_hmtx(self._read_bytes(tbl.offset, tbl.length),
+                                                                         n_metrics, self.n_glyphs))
 
     def get_loca(self,):
         start = self._get_table_offset(b'loca')
-        self._seek(start)
+        self.tables[b'loca'] = self._shared((b'loca', start, self.idx_format, self.n_glyphs),
+                                            lambda: self._read_loca(start))
+
+    def _read_loca(self, start):
         if self.idx_format == 0:
-            self.tables[b'loca'] = [n * 2 for n in self._read_list_uint16(self.n_glyphs + 1)]
+            offsets = read_array('H', self._read_bytes(start, 2 * (self.n_glyphs + 1)))
+            return array(UINT32, [n * 2 for n in offsets])
         elif self.idx_format == 1:
-            self.tables[b'loca'] = self._read_list_uint32(self.n_glyphs + 1)
+            return read_array(UINT32, self._read_bytes(start, 4 * (self.n_glyphs + 1)))
 
     def get_kern_data(self):
         kern = self.get_table(b'kern')
+        if kern is None:
+            self.glyph_kern = KernPairs()
+            self.kern_classes = []
+            return
+        self.glyph_kern, self.kern_classes = self._shared((b'kern-pairs', self._get_table_offset(b'kern')),
+                                                          lambda: self._read_kern_data(kern))
+
+    def _read_kern_data(self, kern):
+        """ Read the kerning subtables. Pairs from format 0 subtables are combined into
+            a single KernPairs, while each format 2 subtable becomes a KernClasses.
+        """
+        glyph_kern = KernPairs()
+        kern_classes = []
+        tbl = self.header.get_tag(b'kern')
         for st in kern.subtables:
-            if st.coverage != 1 or st.version != 0:
+            if st.version != 0 or not st.is_horizontal_kerning or st.format not in (0, 2):
                 print("coverage = {}, version = {}  - skipping".format(st.coverage, st.version))
                 continue
-            self._seek(st.offset + len(st))
-            (npairs, a, b, c) = self._read_list_uint16(4)
-            for n in range(npairs):
-                (l, r) = self._read_list_uint16(2)
-                diff = self._read_int16()
-                self.glyph_kern[(l, r)] = diff
+            if st.format == 0:
+                pos = st.offset + len(st)
+                (npairs, a, b, c) = self._unpack(">4H", pos)
+                glyph_kern = glyph_kern.merge(KernPairs.from_format0(self._read_bytes(pos + 8, 6 * npairs), npairs))
+            else:
+                # The subtable length is only 16 bits, so allow for the rest of the table.
+                data = self._read_bytes(st.offset, tbl.offset + tbl.length - st.offset)
+                kern_classes.append(KernClasses.from_format2(data))
+        return glyph_kern, kern_classes
+
+    def get_kerning(self):
+        """ Set the kerning used to measure text. The pair adjustment lookups for the GPOS
+            kern feature are used if there are any, otherwise the kern table.
+        """
+        lookups = []
+        tbl = self.header.get_tag(b'GPOS')
+        if tbl is not None:
+            try:
+                # The cached list is shared with other faces, so is copied before the
+                # kern table lookups are added.
+                lookups = list(self._shared((b'GPOS-kern', tbl.offset),
+                                            lambda: TTF_gpos.kern_lookups(self._read_bytes(tbl.offset, tbl.length),
+                                                                          self.n_glyphs)))
+            except struct_error:
+                print("Unable to read the GPOS table, using the kern table")
+        if len(lookups) == 0:
+            if len(self.glyph_kern) > 0:
+                lookups.append([self.glyph_kern])
+            lookups.extend([classes] for classes in self.kern_classes)
+        self.kerning = Kerning(lookups)
+
+    def get_kern_value(self, left, right):
+        """ Return the kerning adjustment between two glyphs. """
+        return self.kerning.value(left, right)
 
     def char_to_glyph(self, char):
-        self._open()
         cmap = self.get_table(b'cmap')
-        glyph = cmap.char_to_glyph(char, self.file_handle)
+        glyph = cmap.char_to_glyph(char)
         return glyph or 0
 
+    def get_char_index(self):
+        """ Build the character -> glyph dict covering every character in the cmap. This
+            is only created when first used, as char_index.
+        """
+        cmap = self.get_table(b'cmap')
+        if cmap is None or cmap.map_table is None:
+            self.char_index = {}
+            return
+        self.char_index = self._shared((b'cmap-index', self._get_table_offset(b'cmap')),
+                                       lambda: cmap.char_map(0x10FFFF))
+
+    def enable_dense_cmap(self):
+        """ Resolve BMP characters through a 65536 entry table, which is built on the next
+            lookup. Worthwhile for fonts that are used heavily.
+        """
+        cmap = self.get_table(b'cmap')
+        if cmap is not None and hasattr(cmap.map_table, 'enable_dense_map'):
+            cmap.map_table.enable_dense_map()
+
     def get_glyph_position(self, glyph):
         loca = self.get_table(b'loca')
         return loca[glyph]
 
+    def get_component_graph(self):
+        """ Scan the glyf table for compound glyphs, which is done once on first use. """
+        tbl = self.header.get_tag(b'glyf')
+        if tbl is None:
+            self.component_graph = ComponentGraph()
+            return
+        loca = self.get_table(b'loca')
+        self.component_graph = self._shared((b'glyf-components', tbl.offset),
+                                            lambda: ComponentGraph.from_glyf(self._read_bytes(tbl.offset, tbl.length),
+                                                                             loca))
+
     def get_glyph_components(self, glyph):
         """ Return a list of any component glyphs required. """
-        if glyph < 0 or glyph > self.n_glyphs:
+        if glyph < 0 or glyph >= self.n_glyphs:
             print("Missing glyph!!! {}".format(glyph))
             return []
-        pos = self._get_table_offset(b'glyf') + self.get_glyph_position(glyph)
-        glyf = self._read_class(TTF_glyf, offset=pos, length=glyph)
-        for g in glyf.required:
-            for extra_glyph in self.get_glyph_components(g):
-                if extra_glyph not in glyf.required:
-                    glyf.required.append(extra_glyph)
-        return sorted(glyf.required)
+        return sorted(self.component_graph.closure(glyph))
 
     def get_glyph_data(self, glyph):
         data_start = self._get_table_offset(b'glyf')
@@ -210,18 +504,13 @@ class TTFont(object):
         if glyph_length == 0:
             print("Zero length glyph @ {}".format(glyph))
             return b''
-        self._open()
-        self.file_handle.seek(data_start + glyph_start)
-        return self.file_handle.read(glyph_length)
+        return self._read_bytes(data_start + glyph_start, glyph_length)
 
     def get_binary_table(self, tag):
         tbl = self.header.get_tag(tag)
-        print(tbl)
         if tbl is None:
             return b''
-        self._open()
-        self._seek(tbl.offset)
-        return self.file_handle.read(tbl.length)
+        return self._read_bytes(tbl.offset, tbl.length)
 
     def make_subset(self, subset):
         """ Given a subset of characters, create a subset of the full TTF file suitable for
@@ -231,18 +520,54 @@ class TTFont(object):
         """
         return TTFSubset(self, subset)
 
+    def make_subset_session(self, subset=None):
+        """ Create a subset that characters can be added to incrementally.
+        :param subset: Optional list of characters to start with.
+        :return: TTFSubsetSession object
+        """
+        return TTFSubsetSession(self, subset)
+
+    def close(self):
+        """ Release the file mapping (if any). Views returned by get_glyph_data are
+            only valid until this is called.
+        """
+        if self.data is not None:
+            if self.owns_data:
+                try:
+                    self.data.close()
+                except BufferError:
+                    # Views are still held by the caller, the mapping will be released
+                    # when they are.
+                    pass
+            self.data = None
+            self.file_handle = None
+        self._close()
 
     # File functions.
     def _open(self):
         if self.file_handle is None:
-            self.file_handle = open(self.filename, 'rb')
+            if self.data is None and self.use_mmap:
+                with open(self.filename, 'rb') as fh:
+                    self.data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.data is not None:
+                self.file_handle = BufferReader(self.data)
+            else:
+                self.file_handle = open(self.filename, 'rb')
         self.file_handle.seek(self.start_pos)
 
     def _close(self):
-        if self.file_handle is not None:
+        # The mapping is kept open for the life of the font.
+        if self.file_handle is not None and self.data is None:
             self.file_handle.close()
             self.file_handle = None
 
+    def _release(self):
+        """ Close the file after a read when lazy, so it is not held open between the
+            tables being parsed on demand.
+        """
+        if self.lazy:
+            self._close()
+
     def _seek(self, offset, whence=0):
         self._open()
         pos = self.file_handle.tell()
@@ -256,6 +581,28 @@ class TTFont(object):
             return cls(self.file_handle, length)
         return cls(self.file_handle)
 
+    def _unpack(self, fmt, offset):
+        """ Unpack fmt from the absolute file offset given. """
+        if self.data is not None:
+            return unpack_from(fmt, self.data, offset)
+        with self.lock:
+            self._seek(offset)
+            values = unpack(fmt, self.file_handle.read(calcsize(fmt)))
+            self._release()
+        return values
+
+    def _read_bytes(self, offset, length):
+        """ Return length bytes from the absolute file offset given. When the file is
+            mapped this is a zero-copy memoryview of the mapping.
+        """
+        if self.data is not None:
+            return memoryview(self.data)[offset:offset + length]
+        with self.lock:
+            self._seek(offset)
+            data = self.file_handle.read(length)
+            self._release()
+        return data
+
     def _skip(self, offset):
         if self.file_handle is not None:
             self.file_handle.seek(offset, 1)
@@ -275,3 +622,12 @@ class TTFont(object):
 
     def _read_list_uint32(self, n):
         return read_list_uint32(self.file_handle, n)
+
+
+def _cache_entry_size(entry):
+    """ Approximate size of a string cache entry in bytes. """
+    (kind, string), value = entry
+    size = sys.getsizeof(string)
+    if isinstance(value, GlyphRun):
+        return size + sum(sys.getsizeof(arr) for arr in (value.glyphs, value.advances, value.kerning, value.positions))
+    return size + sys.getsizeof(value)
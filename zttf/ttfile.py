@@ -1,22 +1,152 @@
+import mmap
+from concurrent.futures import ProcessPoolExecutor
 from os.path import exists, getsize
+from threading import Lock
 
-from zttf.objects import TTFCollectionHeader
+from zttf.objects import TTFCollectionHeader, TTFHeader, TTF_name
 from zttf.ttf import TTFont
+from zttf.utils import BufferReader
+
+
+class TTFaceList(object):
+    """ Sequence of the faces in a file. Each face is only parsed the first time it is
+        accessed.
+    """
+    def __init__(self, ttfile, offsets):
+        self.ttfile = ttfile
+        self.offsets = offsets
+        self.fonts = [None] * len(offsets)
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[n] for n in range(*idx.indices(len(self)))]
+        if self.fonts[idx] is None:
+            with self.lock:
+                if self.fonts[idx] is None:
+                    self.fonts[idx] = self.ttfile.make_face(self.offsets[idx])
+        return self.fonts[idx]
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def __repr__(self):
+        return repr(list(self))
 
 
 class TTFile(object):
-    def __init__(self, filename):
+    def __init__(self, filename, lazy=False):
+        """ Open a TrueType font file or collection.
+        :param filename: Path to the file.
+        :param lazy: Passed to each face, see TTFont.
+        """
         self.filename = filename
-        self.faces = []
+        self.lazy = lazy
+        # Parsed tables shared between the faces, keyed by their location in the file.
+        self.table_cache = {}
 
         if not exists(filename) or getsize(filename) == 0:
             raise IOError("The file '{}' does not exist or is empty".format(filename))
 
         with open(self.filename, 'rb') as fh:
-            hdr = TTFCollectionHeader(fh)
-            for off in hdr.offsets:
-                self.faces.append(TTFont(filename, off))
+            self.data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        hdr = TTFCollectionHeader(BufferReader(self.data))
+        self.faces = TTFaceList(self, hdr.offsets)
 
     @property
     def is_valid(self):
         return len(self.faces) > 0
+
+    def make_face(self, offset):
+        return TTFont(self.filename, offset, lazy=self.lazy, data=self.data, table_cache=self.table_cache)
+
+    def face_names(self, idx):
+        """ Return the (PostScript name, family name) for a face, reading only the name table
+            if the face has not been parsed.
+        """
+        font = self.faces.fonts[idx]
+        if font is not None:
+            return font.name, font.font_family
+        fh = BufferReader(self.data)
+        fh.seek(self.faces.offsets[idx])
+        tbl = TTFHeader(fh).get_tag(b'name')
+        if tbl is None:
+            return None, None
+        key = (b'name', tbl.offset, tbl.length, TTF_name)
+        name = self.table_cache.get(key)
+        if name is None:
+            fh.seek(tbl.offset)
+            name = self.table_cache[key] = TTF_name(fh, tbl.length)
+        return name.get_name(6), name.get_name(1)
+
+    def find_face(self, name):
+        """ Find a face by PostScript name, or failing that by family name.
+        :param name: Name to search for
+        :return: The first matching TTFont or None
+        """
+        family_match = None
+        for n in range(len(self.faces)):
+            ps_name, family = self.face_names(n)
+            if ps_name == name:
+                return self.faces[n]
+            if family_match is None and family == name:
+                family_match = n
+        return self.faces[family_match] if family_match is not None else None
+
+    def subset_many(self, subsets, face=0, workers=None, chunksize=1):
+        """ Create subsets of a face in parallel, see subset_many. """
+        return subset_many(self.filename, subsets, face=face, workers=workers, chunksize=chunksize)
+
+    def close(self):
+        """ Release the shared file mapping. Faces can no longer be read after this. """
+        for font in self.faces.fonts:
+            if font is not None:
+                font.close()
+        try:
+            self.data.close()
+        except BufferError:
+            pass
+
+
+# The face used by subset_many worker processes, opened once per process.
+_worker_font = None
+
+
+def _init_worker(filename, face):
+    global _worker_font
+    _worker_font = TTFile(filename, lazy=True).faces[face]
+
+
+def _subset_font(font, subset):
+    return font.make_subset(subset).output()
+
+
+def _subset_job(subset):
+    return _subset_font(_worker_font, subset)
+
+
+def subset_many(filename, subsets, face=0, workers=None, chunksize=1):
+    """ Create subsets of a font using a pool of processes. Each process opens the font
+        once and then creates subsets for as many jobs as it is given.
+    :param filename: Path to the TrueType file or collection
+    :param subsets: List of subsets, each a list of characters
+    :param face: Index of the face within a collection
+    :param workers: Number of processes, defaults to the number of CPUs. With 1 the
+                    subsets are created in this process.
+    :param chunksize: Number of subsets sent to a process at once
+    :return: List of the subset font files (bytearrays), in the same order as subsets
+    """
+    if workers == 1:
+        ttf = TTFile(filename, lazy=True)
+        try:
+            font = ttf.faces[face]
+            return [_subset_font(font, subset) for subset in subsets]
+        finally:
+            ttf.close()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(filename, face)) as pool:
+        return list(pool.map(_subset_job, subsets, chunksize=chunksize))
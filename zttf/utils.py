@@ -1,12 +1,71 @@
-from struct import calcsize, pack, unpack
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from struct import Struct, calcsize, unpack, unpack_from
 
 
-class PackedFormat:
+class PackedCodec(object):
+    """ Compiled form of a PackedFormat FORMAT list for one endianness. All fields are
+        decoded with a single Struct and the convert hooks applied afterwards.
+    """
+    def __init__(self, format_list, endian):
+        fmts = [_f['format'] for _f in format_list if 'format' in _f]
+        self.struct = Struct(endian + ''.join(fmts))
+        self.size = self.struct.size
+        # Names for the decoded values, None for unnamed (skipped) fields.
+        self.names = [_f.get('name') for _f in format_list if 'format' in _f]
+        self.converts = [(_f['name'], _f['convert']) for _f in format_list
+                         if 'format' in _f and 'name' in _f and 'convert' in _f]
+        # Attribute to pack each field from and default if it is missing.
+        self.pack_fields = []
+        for _f in format_list:
+            if 'format' not in _f:
+                continue
+            attr = _f.get('name')
+            if attr is not None and 'convert' in _f:
+                attr += '_raw'
+            self.pack_fields.append((attr, b'' if 's' in _f['format'] else 0))
+
+
+class PackedFormatType(type):
+    """ Metaclass that compiles the FORMAT of each PackedFormat class when it is created.
+        Classes that declare __slots__ have slots added for each named FORMAT field, so
+        records that are created in large numbers don't need an instance dict.
+    """
+    def __new__(mcs, name, bases, attrs):
+        if '__slots__' in attrs:
+            inherited = set()
+            for base in bases:
+                for klass in base.__mro__:
+                    inherited.update(getattr(klass, '__slots__', ()))
+            slots = list(attrs['__slots__'])
+            for _f in attrs.get('FORMAT', []):
+                if 'name' not in _f:
+                    continue
+                names = [_f['name'], _f['name'] + '_raw'] if 'convert' in _f else [_f['name']]
+                slots.extend(n for n in names if n not in inherited and n not in slots)
+            attrs['__slots__'] = tuple(slots)
+        return type.__new__(mcs, name, bases, attrs)
+
+    def __init__(cls, name, bases, attrs):
+        type.__init__(cls, name, bases, attrs)
+        cls._codecs = {'>': PackedCodec(cls.FORMAT, '>')}
+
+    def codec(cls, endian='>'):
+        codec = cls._codecs.get(endian)
+        if codec is None:
+            codec = cls._codecs[endian] = PackedCodec(cls.FORMAT, endian)
+        return codec
+
+
+class PackedFormat(metaclass=PackedFormatType):
     """ Class to allow simpler extraction of data from a stream into an object with
         named attributes.
         All child classes need a FORMAT list of dicts describing the data to be extracted.
 
     """
+    __slots__ = ('endian', 'parsed')
     FORMAT = []
 
     def __init__(self, fh=None, data=None, endian='>'):
@@ -18,42 +77,29 @@ class PackedFormat:
             self.from_data(data)
 
     def from_file(self, fh):
-        for _f in self.FORMAT:
-            if 'format' not in _f:
-                continue
-            _fmt = '{}{}'.format(self.endian, _f['format'])
-            _data = unpack(_fmt, fh.read(calcsize(_fmt)))[0]
-            if 'name' not in _f:
-                continue
-            if 'convert' in _f:
-                setattr(self, _f['name'] + '_raw', _data)
-                _fn = _f['convert'] if callable(_f['convert']) else getattr(self, _f['convert'])
-                if _fn is not None and callable(_fn):
-                    _data = _fn(_data)
-            setattr(self, _f['name'], _data)
-        self.parsed = True
-
-    def from_data(self, data):
-        offset = 0
-        for _f in self.FORMAT:
-            if 'format' not in _f:
-                continue
-            _fmt = '{}{}'.format(self.endian, _f['format'])
-            _data = unpack(_fmt, data[offset: offset + calcsize(_fmt)])[0]
-            setattr(self, _f['name'], _data)
-            offset += calcsize(_fmt)
+        codec = type(self).codec(self.endian)
+        self._set_values(codec, codec.struct.unpack(fh.read(codec.size)))
+
+    def from_data(self, data, offset=0):
+        codec = type(self).codec(self.endian)
+        self._set_values(codec, codec.struct.unpack_from(data, offset))
+
+    def _set_values(self, codec, values):
+        for name, value in zip(codec.names, values):
+            if name is not None:
+                setattr(self, name, value)
+        for name, convert in codec.converts:
+            value = getattr(self, name)
+            setattr(self, name + '_raw', value)
+            _fn = convert if callable(convert) else getattr(self, convert)
+            if _fn is not None and callable(_fn):
+                setattr(self, name, _fn(value))
         self.parsed = True
 
     def as_bytes(self):
-        output = b''
-        for _f in self.FORMAT:
-            _fmt = '{}{}'.format(self.endian, _f['format'])
-            if 'convert' in _f:
-                _val = getattr(self, _f['name'] + '_raw', '' if 's' in _f['format'] else 0)
-            else:
-                _val = getattr(self, _f['name'], '' if 's' in _f['format'] else 0)
-            output += pack(_fmt, _val)
-        return output
+        codec = type(self).codec(self.endian)
+        return codec.struct.pack(*[getattr(self, attr, default) if attr is not None else default
+                                   for attr, default in codec.pack_fields])
 
     def as_string(self):
         def _name_to_string(n):
@@ -80,10 +126,399 @@ class PackedFormat:
         return ss
 
     def __len__(self):
-        fmt = "{}".format(self.endian)
-        for _f in self.FORMAT:
-            fmt += _f['format']
-        return calcsize(fmt)
+        return type(self).codec(self.endian).size
+
+
+class BufferReader(object):
+    """ Minimal read only file object over a buffer (bytes, mmap, ...). This allows several
+        fonts to read from a single shared buffer, each with their own position.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, n=-1):
+        end = len(self.data) if n is None or n < 0 else self.pos + n
+        chunk = self.data[self.pos:end]
+        self.pos += len(chunk)
+        return chunk
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += len(self.data)
+        self.pos = offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        pass
+
+
+# Array typecode for unsigned 32-bit values, 'I' is only guaranteed to be at least 16 bits.
+UINT32 = 'I' if array('I').itemsize == 4 else 'L'
+
+
+def read_array(typecode, data):
+    """ Create an array from big endian data in a single bulk copy.
+    :param typecode: array typecode for the values
+    :param data: bytes like object containing the values
+    :return: array of native values
+    """
+    arr = array(typecode)
+    arr.frombytes(data)
+    if sys.byteorder == 'little':
+        arr.byteswap()
+    return arr
+
+
+class GlyphMetrics(object):
+    """ Horizontal metrics for all glyphs, stored as typed arrays of advance widths
+        and left side bearings. Indexing returns an (advance width, lsb) tuple.
+    """
+    __slots__ = ('advances', 'lsbs')
+
+    def __init__(self, advances=None, lsbs=None):
+        self.advances = advances if advances is not None else array('H')
+        self.lsbs = lsbs if lsbs is not None else array('h')
+
+    @classmethod
+    def from_hmtx(cls, data, n_metrics, n_glyphs):
+        """ Create from the raw hmtx table data.
+        :param data: hmtx table data
+        :param n_metrics: Number of full (advance width, lsb) records, from hhea
+        :param n_glyphs: Number of glyphs in the font, from maxp
+        """
+        records = read_array('H', data[:4 * n_metrics])
+        advances = records[0::2]
+        lsbs = array('h')
+        lsbs.frombytes(records[1::2].tobytes())
+        # Remaining glyphs only have an lsb and use the last advance width.
+        extra = n_glyphs - n_metrics
+        if extra > 0:
+            advances.extend(array('H', advances[-1:] or [0]) * extra)
+            lsbs.extend(read_array('h', data[4 * n_metrics:4 * n_metrics + 2 * extra]))
+        return cls(advances, lsbs)
+
+    def __len__(self):
+        return len(self.advances)
+
+    def __getitem__(self, idx):
+        return self.advances[idx], self.lsbs[idx]
+
+    def __iter__(self):
+        return zip(self.advances, self.lsbs)
+
+
+class KernPairs(object):
+    """ Kerning pairs stored as a sorted array of (left << 16 | right) keys with a
+        parallel array of values. Lookups are binary searches and all the pairs for a
+        left glyph are adjacent. Pairs are given and returned as (left, right) tuples,
+        so this can be used in place of a dict.
+    """
+    __slots__ = ('keys', 'values', 'left_index')
+
+    def __init__(self, keys=None, values=None):
+        self.keys = keys if keys is not None else array(UINT32)
+        self.values = values if values is not None else array('h')
+        # Index of the first pair for each left glyph, built on first lookup.
+        self.left_index = None
+
+    def _build_left_index(self):
+        n_left = (self.keys[-1] >> 16) + 2 if len(self.keys) > 0 else 1
+        index = array(UINT32, [0]) * n_left
+        for key in self.keys:
+            index[(key >> 16) + 1] += 1
+        for left in range(1, n_left):
+            index[left] += index[left - 1]
+        self.left_index = index
+
+    @classmethod
+    def from_format0(cls, data, n_pairs):
+        """ Create from the pair records of a format 0 kern subtable (or GPOS pair
+            adjustments packed the same way).
+        :param data: Data starting at the first pair record
+        :param n_pairs: Number of 6 byte pair records
+        """
+        records = unpack(">" + "Ih" * n_pairs, data[:6 * n_pairs])
+        keys = array(UINT32, records[0::2])
+        values = array('h', records[1::2])
+        if any(a >= b for a, b in zip(keys, keys[1:])):
+            return cls.from_items(zip(keys, values))
+        return cls(keys, values)
+
+    @classmethod
+    def from_items(cls, items):
+        """ Create from (key, value) items, where later items replace earlier ones. """
+        merged = sorted(dict(items).items())
+        return cls(array(UINT32, [k for k, v in merged]), array('h', [v for k, v in merged]))
+
+    def merge(self, other):
+        """ Return a new KernPairs with the pairs from other added, replacing any existing values. """
+        if len(self) == 0:
+            return other
+        return self.from_items(chain(zip(self.keys, self.values), zip(other.keys, other.values)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _find(self, key):
+        start, end = self.left_range(key >> 16)
+        if start == end:
+            return -1
+        idx = bisect_left(self.keys, key, start, end)
+        if idx < end and self.keys[idx] == key:
+            return idx
+        return -1
+
+    def value(self, left, right, default=0):
+        # This is called for every glyph pair when measuring, so avoids _find().
+        index = self.left_index
+        if index is None:
+            self._build_left_index()
+            index = self.left_index
+        if left + 1 >= len(index):
+            return default
+        start = index[left]
+        end = index[left + 1]
+        if start == end:
+            return default
+        key = (left << 16) | right
+        idx = bisect_left(self.keys, key, start, end)
+        if idx < end and self.keys[idx] == key:
+            return self.values[idx]
+        return default
+
+    def get(self, pair, default=None):
+        return self.value(pair[0], pair[1], default)
+
+    def __getitem__(self, pair):
+        idx = self._find((pair[0] << 16) | pair[1])
+        if idx < 0:
+            raise KeyError(pair)
+        return self.values[idx]
+
+    def __contains__(self, pair):
+        return self._find((pair[0] << 16) | pair[1]) >= 0
+
+    def left_range(self, left):
+        """ Return the (start, end) indices of the pairs with the left glyph given. """
+        if self.left_index is None:
+            self._build_left_index()
+        if left + 1 >= len(self.left_index):
+            return 0, 0
+        return self.left_index[left], self.left_index[left + 1]
+
+    def pairs_for_left(self, left):
+        """ Yield (right, value) for all pairs with the left glyph given. """
+        start, end = self.left_range(left)
+        for idx in range(start, end):
+            yield self.keys[idx] & 0xFFFF, self.values[idx]
+
+    def items(self):
+        for key, value in zip(self.keys, self.values):
+            yield (key >> 16, key & 0xFFFF), value
+
+
+class KernClasses(object):
+    """ Class based kerning. Glyphs are mapped to left and right classes and the values
+        held in a matrix of left class rows and right class columns, so pairs are never
+        expanded. Glyphs without a class have no kerning.
+    """
+    NO_CLASS = 0xFFFF
+    __slots__ = ('left_first', 'left_classes', 'right_first', 'right_classes', 'n_cols', 'values')
+
+    def __init__(self, left_first, left_classes, right_first, right_classes, n_cols, values):
+        self.left_first = left_first
+        self.left_classes = left_classes
+        self.right_first = right_first
+        self.right_classes = right_classes
+        self.n_cols = n_cols
+        self.values = values
+
+    @classmethod
+    def from_format2(cls, data):
+        """ Create from a format 2 kern subtable.
+        :param data: Data starting at the subtable header
+        """
+        row_width, left_offset, right_offset, array_offset = unpack_from(">4H", data, 6)
+        n_cols = row_width // 2
+        left_first, n_left = unpack_from(">2H", data, left_offset)
+        right_first, n_right = unpack_from(">2H", data, right_offset)
+        # Left values are offsets from the start of the subtable to the row and right
+        # values are offsets into the row.
+        rows = array('H', [(v - array_offset) // row_width
+                           if v >= array_offset and (v - array_offset) % row_width == 0 else cls.NO_CLASS
+                           for v in read_array('H', data[left_offset + 4:left_offset + 4 + 2 * n_left])])
+        cols = array('H', [v // 2 if v // 2 < n_cols else cls.NO_CLASS
+                           for v in read_array('H', data[right_offset + 4:right_offset + 4 + 2 * n_right])])
+        n_rows = max([r + 1 for r in rows if r != cls.NO_CLASS] or [0])
+        values = read_array('h', data[array_offset:array_offset + n_rows * row_width])
+        return cls(left_first, rows, right_first, cols, n_cols, values)
+
+    def left_class(self, glyph):
+        idx = glyph - self.left_first
+        return self.left_classes[idx] if 0 <= idx < len(self.left_classes) else self.NO_CLASS
+
+    def right_class(self, glyph):
+        idx = glyph - self.right_first
+        return self.right_classes[idx] if 0 <= idx < len(self.right_classes) else self.NO_CLASS
+
+    def value(self, left, right, default=0):
+        row = self.left_class(left)
+        col = self.right_class(right)
+        if row == self.NO_CLASS or col == self.NO_CLASS:
+            return default
+        return self.values[row * self.n_cols + col]
+
+    def class_arrays(self, n_glyphs):
+        """ Return arrays of the left and right class for every glyph, NO_CLASS where a
+            glyph has none.
+        """
+        def _expand(first, classes):
+            full = array('H', [self.NO_CLASS]) * n_glyphs
+            end = min(n_glyphs, first + len(classes))
+            if end > first:
+                full[first:end] = classes[:end - first]
+            return full
+        return _expand(self.left_first, self.left_classes), _expand(self.right_first, self.right_classes)
+
+
+class Kerning(object):
+    """ The kerning used to measure text, as a list of lookups each of which is a list
+        of KernPairs / KernClasses subtables. The first subtable in a lookup that has a
+        value for a pair is used, and the values from each lookup are added together.
+    """
+    __slots__ = ('lookups',)
+
+    def __init__(self, lookups=None):
+        self.lookups = lookups or []
+
+    def __len__(self):
+        return len(self.lookups)
+
+    def value(self, left, right):
+        total = 0
+        for lookup in self.lookups:
+            for subtable in lookup:
+                value = subtable.value(left, right, None)
+                if value is not None:
+                    total += value
+                    break
+        return total
+
+
+class ComponentGraph(object):
+    """ The component glyphs used by each compound glyph, with the full set of glyphs
+        each one needs (including components of components) found on first use.
+    """
+    __slots__ = ('components', 'closures')
+
+    def __init__(self, components=None):
+        # Direct components of each compound glyph.
+        self.components = components if components is not None else {}
+        self.closures = {}
+
+    @classmethod
+    def from_glyf(cls, data, loca):
+        """ Create by scanning the glyphs in a glyf table.
+        :param data: glyf table data
+        :param loca: Offset of each glyph within data, with the end of the last glyph.
+        """
+        components = {}
+        for glyph in range(len(loca) - 1):
+            pos = loca[glyph]
+            if loca[glyph + 1] - pos < 10 or unpack_from(">h", data, pos)[0] >= 0:
+                continue
+            required = []
+            pos += 10
+            while True:
+                flags, component = unpack_from(">HH", data, pos)
+                required.append(component)
+                pos += 4 + calcsize(glyf_skip_format(flags))
+                if not glyph_more_components(flags):
+                    break
+            components[glyph] = tuple(required)
+        return cls(components)
+
+    def __len__(self):
+        return len(self.components)
+
+    def closure(self, glyph):
+        """ Return a frozenset of all the glyphs needed to draw glyph, not including glyph. """
+        result = self.closures.get(glyph)
+        if result is None:
+            required = set()
+            pending = list(self.components.get(glyph, ()))
+            while len(pending) > 0:
+                component = pending.pop()
+                if component in required or component == glyph:
+                    continue
+                required.add(component)
+                known = self.closures.get(component)
+                if known is not None:
+                    required.update(known)
+                else:
+                    pending.extend(self.components.get(component, ()))
+            result = self.closures[glyph] = frozenset(required)
+        return result
+
+    def glyph_closure(self, glyphs):
+        """ Return the set of glyphs with all the glyphs they need. """
+        required = set(glyphs)
+        for glyph in list(required):
+            if glyph in self.components:
+                required.update(self.closure(glyph))
+        return required
+
+
+class GlyphRun(object):
+    """ A string converted to glyphs, with the advance width of each glyph, the kerning
+        between each glyph and the next (0 after the last) and the x position of each
+        glyph relative to the first. The width matches TTFont.get_string_width.
+    """
+    __slots__ = ('glyphs', 'advances', 'kerning', 'positions', 'lsb')
+
+    def __init__(self, glyphs=None, advances=None, kerning=None, lsb=0):
+        self.glyphs = glyphs if glyphs is not None else array('H')
+        self.advances = advances if advances is not None else array('H')
+        self.kerning = kerning if kerning is not None else array('h')
+        self.lsb = lsb
+        self.positions = array('l', [0]) * len(self.glyphs)
+        x = 0
+        for n, (aw, kern) in enumerate(zip(self.advances, self.kerning)):
+            self.positions[n] = x
+            x += aw + kern
+
+    @classmethod
+    def from_glyphs(cls, glyphs, metrics, kern_values):
+        """ Create from a list of glyphs.
+        :param glyphs: Glyph ids
+        :param metrics: GlyphMetrics for the font
+        :param kern_values: Kerning between each pair of adjacent glyphs
+        """
+        advances = metrics.advances
+        kerning = array('h', kern_values)
+        if len(glyphs) > 0:
+            kerning.append(0)
+        return cls(array('H', glyphs), array('H', [advances[g] for g in glyphs]), kerning,
+                   metrics.lsbs[glyphs[0]] if len(glyphs) > 0 else 0)
+
+    def __len__(self):
+        return len(self.glyphs)
+
+    def __iter__(self):
+        """ Yields (glyph, advance, kerning, position) for each glyph. """
+        return zip(self.glyphs, self.advances, self.kerning, self.positions)
+
+    @property
+    def width(self):
+        if len(self.glyphs) == 0:
+            return 0
+        return self.positions[-1] + self.advances[-1] - self.lsb
 
 
 def fixed_version(num):
@@ -100,8 +535,8 @@ def binary_search_parameters(length):
     :param length: The range over which the search will be performed.
     :return: The 2 parameters required.
     """
-    search_range = 2
-    entry_selector = 1
+    search_range = 1
+    entry_selector = 0
     while search_range * 2 <= length:
         search_range *= 2
         entry_selector += 1
@@ -109,6 +544,8 @@ def binary_search_parameters(length):
 
 
 class Range:
+    __slots__ = ('start', 'end', 'start_glyph', 'iddelta', 'offset')
+
     def __init__(self, start = 0, glyph=0):
         self.start = start
         self.expand(start)
@@ -166,11 +603,14 @@ def read_list_uint32(fh, n):
 
 
 def ttf_checksum(data):
-    data += b'\0' * (4 - (len(data) % 4))
-    n_uint32 = int(len(data) / 4)
-    chksum = 0
-    for val in unpack(">{}I".format(n_uint32), data):
-        chksum += val
+    """ Sum of the data as big endian uint32 values, padded with zeros to a multiple
+        of 4 bytes.
+    :param data: bytes, bytearray or memoryview
+    """
+    whole = len(data) & ~3
+    chksum = sum(read_array(UINT32, data[:whole]))
+    if whole < len(data):
+        chksum += unpack(">I", bytes(data[whole:]) + b'\0' * (4 - len(data) + whole))[0]
     return chksum & 0xFFFFFFFF
 
 